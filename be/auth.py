@@ -1,4 +1,6 @@
 import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
@@ -21,21 +23,38 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 59
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt takes ~100-300ms of CPU per call, so it runs on a small bounded pool
+# instead of blocking the event loop
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+hash_executor = ThreadPoolExecutor(
+    max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
 
-def hash_password(password):
-    return pwd_context.hash(password)
 
+async def hash_password(password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(hash_executor, pwd_context.hash, password)
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+
+async def verify_password(plain_password, hashed_password):
+    # returns (valid, new_hash); new_hash is set when the stored hash is
+    # outdated per pwd_context.needs_update
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        hash_executor, pwd_context.verify_and_update, plain_password, hashed_password)
 
 
 async def authenticate_user(username: str, password: str):
     user = await dal.get_user(username=username)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    if not user or not verify_password(password, user["hashed_password"]):
+    valid, new_hash = await verify_password(password, user["hashed_password"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
+    if new_hash:
+        await dal.update_password(user["_id"], new_hash)
+
     return user
 
 
@@ -54,7 +73,7 @@ async def decode_token(token: str):
         if username is None:
             raise HTTPException(status_code=401, detail="Invalid token")
 
-        user = await dal.get_user(username=username)
+        user = await dal.get_principal(username)
 
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
@@ -0,0 +1,70 @@
+# per-request cost of resolving a bearer token to its user, with the
+# get_principal cache warm and cold, e.g. `python bench_auth.py`; user
+# lookups are answered by a counting stub, so no MongoDB is needed
+
+import time
+import asyncio
+import argparse
+
+from bson.objectid import ObjectId
+from jose import jwt
+
+import auth
+import dal
+
+
+class CountingFindOne:
+    def __init__(self):
+        self.queries = 0
+
+    async def __call__(self, query, *args, **kwargs):
+        self.queries += 1
+        return {"_id": ObjectId(), "username": query.get("username"), "name": "Reader",
+                "is_active": True, "is_admin": False, "hashed_password": "x"}
+
+
+async def run(tokens, find_one):
+    find_one.queries = 0
+    started = time.perf_counter()
+    for token in tokens:
+        await auth.decode_token(token)
+    elapsed = time.perf_counter() - started
+    return elapsed / len(tokens) * 1e6, find_one.queries / len(tokens)
+
+
+async def bench(number):
+    auth.SECRET_KEY = auth.SECRET_KEY or "bench-secret"
+    find_one = CountingFindOne()
+    dal.user_collection.find_one = find_one
+
+    token = auth.create_access_token({"sub": "reader"})
+    started = time.perf_counter()
+    for _ in range(number):
+        jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+    jwt_us = (time.perf_counter() - started) / number * 1e6
+
+    # every token names a different user, so each call misses the cache
+    cold = [auth.create_access_token({"sub": f"reader-{i}"}) for i in range(number)]
+    cold_us, cold_queries = await run(cold, find_one)
+
+    await auth.decode_token(token)
+    warm_us, warm_queries = await run([token] * number, find_one)
+
+    print(f"{number} calls per case; find_one is an in-process stub, so a real")
+    print("MongoDB round trip adds its network latency to every query")
+    print(f"{'case':<18} {'queries/call':>12} {'us/call':>9}")
+    print(f"{'jwt decode only':<18} {0:>12.2f} {jwt_us:>9.1f}")
+    print(f"{'uncached':<18} {cold_queries:>12.2f} {cold_us:>9.1f}")
+    print(f"{'cached':<18} {warm_queries:>12.2f} {warm_us:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Token to principal benchmark")
+    parser.add_argument("--number", type=int, default=2000, help="calls per case")
+    args = parser.parse_args()
+
+    asyncio.run(bench(args.number))
+
+
+if __name__ == "__main__":
+    main()
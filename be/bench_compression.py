@@ -0,0 +1,72 @@
+# storage size vs. decode latency of chapter bodies, e.g.
+# `python bench_compression.py chapter1.txt chapter2.txt`; with no files a
+# synthetic Vietnamese chapter is used
+
+import gzip
+import random
+import argparse
+import timeit
+
+from util import compress_text, decompress_text
+
+WORDS = ("anh em mình người nói rằng không có một những đã đến khi này "
+         "trong lòng cô ấy nhìn về phía trước con đường nhà đêm ngày "
+         "thời gian nhưng vẫn chưa biết được gì lại đi cùng với").split()
+
+
+def sample_chapter(words=3000, seed=1):
+    rng = random.Random(seed)
+    sentences = []
+    while words > 0:
+        length = rng.randint(6, 20)
+        words -= length
+        sentence = " ".join(rng.choice(WORDS) for _ in range(length))
+        sentences.append(sentence.capitalize() + ".")
+    return "\n\n".join(" ".join(sentences[i:i + 5]) for i in range(0, len(sentences), 5))
+
+
+def per_call_ms(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1000
+
+
+def bench(texts, number):
+    raw = sum(len(text.encode("utf-8")) for text in texts)
+    print(f"{len(texts)} chapter(s), {raw / len(texts) / 1024:.1f} KiB UTF-8 on average")
+    print(f"{'level':>5} {'stored KiB':>10} {'ratio':>6} {'encode ms':>10} {'decode ms':>10}")
+
+    for level in (1, 6, 9):
+        stored = [gzip.compress(text.encode("utf-8"), compresslevel=level, mtime=0)
+                  for text in texts]
+        size = sum(map(len, stored))
+        encode = per_call_ms(lambda: [gzip.compress(text.encode("utf-8"), compresslevel=level, mtime=0)
+                                      for text in texts], number) / len(texts)
+        decode = per_call_ms(lambda: [gzip.decompress(data).decode("utf-8")
+                                      for data in stored], number) / len(texts)
+        marker = "  <- compress_text" if level == 6 else ""
+        print(f"{level:>5} {size / len(texts) / 1024:>10.1f} {raw / size:>6.2f} "
+              f"{encode:>10.3f} {decode:>10.3f}{marker}")
+
+    # the functions the read and write paths actually call
+    stored = [compress_text(text) for text in texts]
+    assert [decompress_text(data) for data in stored] == texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chapter body compression benchmark")
+    parser.add_argument("files", nargs="*", help="UTF-8 chapter text files")
+    parser.add_argument("--number", type=int, default=50, help="calls per timing run")
+    args = parser.parse_args()
+
+    if args.files:
+        texts = []
+        for path in args.files:
+            with open(path, encoding="utf-8") as f:
+                texts.append(f.read())
+    else:
+        texts = [sample_chapter(seed=seed) for seed in range(5)]
+
+    bench(texts, args.number)
+
+
+if __name__ == "__main__":
+    main()
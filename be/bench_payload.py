@@ -0,0 +1,64 @@
+# size and encode time of a /books/{id} response for a large synthetic novel,
+# as the table of contents get_book now returns and with every chapter body,
+# e.g. `python bench_payload.py --chapters 2000`
+
+import gzip
+import timeit
+import argparse
+
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+import responses
+from bench_compression import sample_chapter
+
+
+def synthetic_book(chapters, words, with_content):
+    author_id = ObjectId()
+    book = {
+        "_id": ObjectId(),
+        "title": "Đường về nhà",
+        "description": sample_chapter(words=120),
+        "cover": str(ObjectId()),
+        "created_at": datetime(2024, 1, 1),
+        "updated_at": datetime(2024, 6, 1),
+        "is_valid": True,
+        "is_approved": True,
+        "chapter_count": chapters,
+        "rating": {"averageRating": 4.2, "ratingCount": 130},
+        "author_id": author_id,
+        "author": "Ann",
+        "genres": [{"_id": ObjectId(), "name": "Romance", "description": "Love stories"}],
+        "chapters": [],
+    }
+
+    # a handful of distinct bodies, so building the book stays quick
+    bodies = [sample_chapter(words=words, seed=seed) for seed in range(8)] if with_content else []
+    for number in range(1, chapters + 1):
+        chapter = {"chapter_number": number, "title": f"Chương {number}", "price": 0}
+        if with_content:
+            chapter["content"] = bodies[number % len(bodies)]
+        book["chapters"].append(chapter)
+    return book
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Book detail payload benchmark")
+    parser.add_argument("--chapters", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=3000, help="words per chapter body")
+    parser.add_argument("--number", type=int, default=5, help="encodes per timing run")
+    args = parser.parse_args()
+
+    print(f"{args.chapters} chapters, {args.words} words per chapter body")
+    print(f"{'form':<18} {'bytes':>12} {'gzip bytes':>11} {'encode ms':>10}")
+    for label, with_content in (("table of contents", False), ("with content", True)):
+        book = synthetic_book(args.chapters, args.words, with_content)
+        data = responses.dumps(book)
+        encode = min(timeit.repeat(lambda: responses.dumps(book), number=args.number, repeat=3))
+        print(f"{label:<18} {len(data):>12,} {len(gzip.compress(data)):>11,} "
+              f"{encode / args.number * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+# read cache for the data access layer, in-process or shared through redis
+
+import os
+import time
+import json
+import uuid
+import pickle
+import asyncio
+import logging
+import functools
+
+from collections import OrderedDict
+
+import redis.asyncio as redis
+from bson.objectid import ObjectId
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+caches = {}
+
+
+class MemoryBackend:
+    """
+    Per-process store: one bounded LRU per cache name, entries expire by TTL.
+    """
+
+    def __init__(self):
+        self._stores = {}
+
+    def _store(self, name):
+        return self._stores.setdefault(name, OrderedDict())
+
+    async def get(self, name, key):
+        store = self._store(name)
+        entry = store.get(key)
+        if entry and entry[0] > time.monotonic():
+            store.move_to_end(key)
+            return True, entry[1]
+        return False, None
+
+    async def set(self, name, key, value, ttl, maxsize):
+        store = self._store(name)
+        store[key] = (time.monotonic() + ttl, value)
+        store.move_to_end(key)
+        while len(store) > maxsize:
+            store.popitem(last=False)
+
+    async def invalidate(self, name, prefix):
+        self.drop(name, prefix)
+
+    def drop(self, name, prefix):
+        store = self._store(name)
+        for key in [k for k in store if k[:len(prefix)] == prefix]:
+            del store[key]
+
+    def size(self, name):
+        return len(self._store(name))
+
+
+class RedisBackend:
+    """
+    Shared store in redis so every worker sees the same entries. Each worker
+    also keeps a short-lived near cache in memory, and invalidations are
+    published so the other workers drop their near copies too.
+
+    Every key is indexed under each of its prefixes in a sorted set scored by
+    expiry time, so invalidating a prefix touches only its own keys.
+
+    Redis failures are logged and treated as misses, so reads fall back to
+    loading from the database. Values are pickled, so the redis instance
+    must be trusted.
+    """
+
+    CHANNEL = "novel-cache:invalidate"
+    RECONNECT_SECONDS = 1
+
+    def __init__(self, client, namespace="novel-cache", near_ttl=5, near_maxsize=1024):
+        self.client = client
+        self.namespace = namespace
+        self.near_ttl = near_ttl
+        self.near_maxsize = near_maxsize
+        self.near = MemoryBackend()
+        self._origin = uuid.uuid4().hex
+        self._listener = None
+
+    def _key(self, name, key):
+        return f"{self.namespace}:{name}:" + "\x1f".join(map(repr, key))
+
+    def _index(self, name, prefix):
+        return f"{self.namespace}:{name}#" + "\x1f".join(map(repr, prefix))
+
+    async def get(self, name, key):
+        found, value = await self.near.get(name, key)
+        if found:
+            return found, value
+
+        try:
+            data = await self.client.get(self._key(name, key))
+        except RedisError as e:
+            logger.error("Cache read from redis failed: %s", e)
+            return False, None
+        if data is None:
+            return False, None
+
+        value = pickle.loads(data)
+        await self.near.set(name, key, value, self.near_ttl, self.near_maxsize)
+        return True, value
+
+    async def set(self, name, key, value, ttl, maxsize):
+        # redis bounds memory through its own maxmemory eviction policy
+        redis_key = self._key(name, key)
+        expires = time.time() + ttl
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.set(redis_key, pickle.dumps(value), px=int(ttl * 1000))
+                for i in range(len(key)):
+                    index = self._index(name, key[:i])
+                    pipe.zadd(index, {redis_key: expires})
+                    pipe.zremrangebyscore(index, "-inf", time.time())
+                    # a cache has one TTL, so the newest entry expires last
+                    pipe.pexpire(index, int(ttl * 1000))
+                await pipe.execute()
+        except RedisError as e:
+            logger.error("Cache write to redis failed: %s", e)
+        await self.near.set(name, key, value, min(ttl, self.near_ttl), self.near_maxsize)
+
+    async def invalidate(self, name, prefix):
+        self.near.drop(name, prefix)
+
+        index = self._index(name, prefix)
+        try:
+            # the index holds ("a", ...) keys only, never ("ab", ...)
+            stale = await self.client.zrange(index, 0, -1)
+            await self.client.unlink(self._key(name, prefix), *stale)
+            if stale:
+                await self.client.zrem(index, *stale)
+
+            await self.client.publish(self.CHANNEL, json.dumps({
+                "origin": self._origin,
+                "name": name,
+                "prefix": list(prefix),
+            }))
+        except RedisError as e:
+            # the write already happened; other workers catch up by TTL
+            logger.error("Cache invalidation in redis failed: %s", e)
+
+    def size(self, name):
+        return self.near.size(name)
+
+    def drop_near(self):
+        # anything may have changed while invalidations were not received
+        self.near = MemoryBackend()
+        for cache in caches.values():
+            cache.generation += 1
+
+    async def start(self):
+        self._listener = asyncio.create_task(self._listen(await self._subscribe()))
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+        await self.client.aclose()
+
+    async def _subscribe(self):
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(self.CHANNEL)
+        return pubsub
+
+    async def _listen(self, pubsub):
+        while True:
+            try:
+                async for message in pubsub.listen():
+                    self._on_message(message)
+                logger.error("Cache invalidation channel closed, resubscribing")
+            except RedisError as e:
+                logger.error("Cache invalidation channel lost, resubscribing: %s", e)
+
+            try:
+                await pubsub.aclose()
+            except RedisError:
+                pass
+
+            pubsub = None
+            while pubsub is None:
+                await asyncio.sleep(self.RECONNECT_SECONDS)
+                try:
+                    pubsub = await self._subscribe()
+                except RedisError as e:
+                    logger.error("Cannot resubscribe to cache invalidations: %s", e)
+            self.drop_near()
+
+    def _on_message(self, message):
+        if message["type"] != "message":
+            return
+        try:
+            data = json.loads(message["data"])
+            if data["origin"] != self._origin:
+                self.near.drop(data["name"], tuple(data["prefix"]))
+                invalidated = caches.get(data["name"])
+                if invalidated:
+                    invalidated.generation += 1
+        except Exception as e:
+            logger.error("Bad cache invalidation message: %s", e)
+
+
+backend = MemoryBackend()
+
+
+async def configure():
+    # CACHE_REDIS_URL switches every cache to the shared redis backend
+    global backend
+    url = os.getenv("CACHE_REDIS_URL")
+    if not url:
+        return
+
+    backend = RedisBackend(redis.from_url(url))
+    await backend.start()
+
+
+async def close():
+    if isinstance(backend, RedisBackend):
+        await backend.stop()
+
+
+class Cache:
+    """
+    Named cache with a per-entry TTL and LRU bound, stored in the configured
+    backend. Concurrent misses on the same key share a single load. Cached
+    values are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, name, ttl, maxsize=1024):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._loading = {}
+
+    async def get(self, key, load):
+        found, value = await backend.get(self.name, key)
+        if found:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        task = self._loading.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, load))
+            self._loading[key] = task
+            task.add_done_callback(functools.partial(self._loaded, key))
+
+        # shield so one cancelled caller doesn't cancel the shared load
+        return await asyncio.shield(task)
+
+    async def _load(self, key, load):
+        generation = self.generation
+        value = await load()
+
+        # drop results that raced with an invalidation
+        if generation == self.generation:
+            await backend.set(self.name, key, value, self.ttl, self.maxsize)
+        return value
+
+    def _loaded(self, key, task):
+        if self._loading.get(key) is task:
+            del self._loading[key]
+
+    async def invalidate(self, *prefix):
+        # drop every key starting with prefix, or everything if none is given
+        self.generation += 1
+        prefix = make_key(prefix, {})
+        for key in [k for k in self._loading if k[:len(prefix)] == prefix]:
+            del self._loading[key]
+
+        await backend.invalidate(self.name, prefix)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": backend.size(self.name),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+        }
+
+
+class ByteLRU:
+    """
+    In-process LRU of small immutable blobs, bounded by their total size.
+    """
+
+    def __init__(self, max_bytes, max_item_bytes):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        data = self._entries.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def set(self, key, data):
+        if len(data) > self.max_item_bytes or key in self._entries:
+            return
+
+        self._entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def discard(self, key):
+        data = self._entries.pop(key, None)
+        if data is not None:
+            self.size -= len(data)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": self.size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+def make_key(args, kwargs):
+    # ids arrive both as str and ObjectId, so key on their string form
+    args = tuple(str(a) if isinstance(a, ObjectId) else a for a in args)
+    return args + tuple(sorted(kwargs.items()))
+
+
+def cached(ttl, maxsize=1024):
+    def decorator(func):
+        cache = Cache(func.__name__, ttl, maxsize)
+        caches[cache.name] = cache
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await cache.get(make_key(args, kwargs), lambda: func(*args, **kwargs))
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+def get_stats():
+    stats = {name: cache.stats() for name, cache in caches.items()}
+    stats["backend"] = type(backend).__name__
+    return stats
@@ -2,18 +2,31 @@
 
 import os
 import io
+import asyncio
+import logging
 
-from datetime import datetime
+from datetime import datetime, timedelta
+from collections import OrderedDict
 
 from fastapi import File, UploadFile
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 
 from bson.objectid import ObjectId
+from pymongo import InsertOne, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from gridfs.errors import NoFile
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
 
+from util import encode_cursor, decode_cursor, parse_range, search_terms, compress_text, decompress_text
+from cache import ByteLRU, cached
+import images
+import suggest
+
 from dotenv import load_dotenv
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Connect to MongoDB
 MONGODB_URI = os.getenv("MONGODB_URI")
 DATABASE_NAME = "novel"
@@ -27,29 +40,36 @@ user_collection = db["users"]
 book_collection = db["novels"]
 genre_collection = db["genres"]
 chapter_collection = db["chapters"]
+chapter_body_collection = db["chapter_bodies"]
 rating_collection = db["ratings"]
 comment_collection = db["comments"]
+genre_stats_collection = db["genre_stats"]
+# daily novel counts behind /novel-stats, kept by the write paths; run
+# `python manage.py rebuild-novel-stats` once when deploying, before novels
+# are created, since it overwrites counts a concurrent write may bump
+novel_daily_collection = db["novel_stats_daily"]
+
+# read /genre-stats from the genre_stats counters instead of aggregating
+# novels; run `python manage.py rebuild-genre-stats` before turning it on
+MATERIALIZED_GENRE_STATS = os.getenv("MATERIALIZED_GENRE_STATS", "") == "1"
 
 
 async def get_users():
-    users = []
-    async for user in user_collection.find({"is_admin": False}):
-        user["_id"] = str(user["_id"])
-        users.append(user)
-    return users
+    return await user_collection.find({"is_admin": False}).to_list(None)
 
 
-async def get_genres():
-    genres = []
-    cursor = genre_collection.find()
+async def invalidate_book(book_id):
+    # drop every cached read scoped to this novel
+    for read in (get_book, get_chapter, get_reading_book, get_rating):
+        await read.cache.invalidate(book_id)
 
-    async for genre in cursor:
-        genre["_id"] = str(genre["_id"])
-        genres.append(genre)
 
-    return genres
+@cached(ttl=300)
+async def get_genres():
+    return await genre_collection.find().to_list(None)
 
 
+@cached(ttl=300)
 async def get_chapter(book_id, chapter_num):
     chapter = await chapter_collection.find_one({
         "novel_id": ObjectId(book_id),
@@ -57,31 +77,143 @@ async def get_chapter(book_id, chapter_num):
     })
 
     if chapter:
-        chapter["_id"] = str(chapter["_id"])
-        chapter["novel_id"] = str(chapter["novel_id"])
+        if "content" not in chapter:
+            body = await chapter_body_collection.find_one({"_id": chapter["_id"]})
+            if not body:
+                logger.error("Chapter %s has no chapter_bodies entry", chapter["_id"])
+            chapter["content"] = decompress_text(body["data"]) if body else ""
 
     return chapter
 
 
-async def get_rating(book_id):
-    pipeline = [
-        {"$match": {"novel_id": ObjectId(book_id)}},
-        {
-            "$group": {
-                "_id": "$novel_id",
-                "average_rating": {"$avg": "$rating"},
-                "rating_count": {"$sum": 1}
-            }
-        }
-    ]
+# chapters loaded ahead of a sequential reader; 0 turns read-ahead off
+CHAPTER_READ_AHEAD = int(os.getenv("CHAPTER_READ_AHEAD", "2"))
 
-    result = await rating_collection.aggregate(pipeline).to_list(length=1)
+read_ahead = {"prefetched": 0, "hits": 0}
+_prefetched = OrderedDict()
+_prefetch_tasks = set()
 
-    if result:
-        return {
-            "averageRating": result[0]["average_rating"],
-            "ratingCount": result[0]["rating_count"]
-        }
+
+def prefetch_chapters(book_id, chapter_num, last_chapter):
+    # warm the get_chapter cache with the next CHAPTER_READ_AHEAD chapters
+    for number in range(chapter_num + 1, min(chapter_num + CHAPTER_READ_AHEAD, last_chapter) + 1):
+        key = (str(book_id), number)
+        if key in _prefetched:
+            continue
+
+        _prefetched[key] = True
+        while len(_prefetched) > 4096:
+            _prefetched.popitem(last=False)
+
+        task = asyncio.create_task(get_chapter(book_id, number))
+        _prefetch_tasks.add(task)
+        task.add_done_callback(_prefetch_done)
+        read_ahead["prefetched"] += 1
+
+
+def _prefetch_done(task):
+    _prefetch_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.warning("Chapter prefetch failed: %s", task.exception())
+
+
+def record_chapter_read(book_id, chapter_num):
+    if _prefetched.pop((str(book_id), chapter_num), None):
+        read_ahead["hits"] += 1
+
+
+def get_read_ahead_stats():
+    prefetched = read_ahead["prefetched"]
+    return {
+        **read_ahead,
+        "k": CHAPTER_READ_AHEAD,
+        "hit_rate": read_ahead["hits"] / prefetched if prefetched else 0
+    }
+
+
+async def get_chapter_body(book_id, chapter_num):
+    # the stored gzip bytes of a chapter, for passing straight to clients
+    chapter = await chapter_collection.find_one(
+        {"novel_id": ObjectId(book_id), "chapter_number": chapter_num},
+        {"content": 1}
+    )
+    if not chapter:
+        return None
+
+    # chapters not yet moved by `manage.py compress-chapters`
+    if "content" in chapter:
+        return compress_text(chapter["content"])
+
+    body = await chapter_body_collection.find_one({"_id": chapter["_id"]})
+    if not body:
+        logger.error("Chapter %s has no chapter_bodies entry", chapter["_id"])
+        return None
+    return body["data"]
+
+
+async def store_chapter_bodies(docs):
+    # move each doc's content into a gzip-compressed chapter_bodies entry
+    # sharing the chapter's _id; called before the chapters are inserted, so
+    # a chapter never exists without its body
+    bodies = []
+    for doc in docs:
+        doc.setdefault("_id", ObjectId())
+        bodies.append({
+            "_id": doc["_id"],
+            "novel_id": doc["novel_id"],
+            "data": compress_text(doc.pop("content"))
+        })
+
+    if bodies:
+        await chapter_body_collection.insert_many(bodies, ordered=False)
+    return docs
+
+
+async def compress_chapters(batch_size=200):
+    # migrate inline chapter content into chapter_bodies
+    moved = 0
+    while True:
+        chapters = await chapter_collection.find(
+            {"content": {"$exists": True}}, {"novel_id": 1, "content": 1}
+        ).limit(batch_size).to_list(None)
+        if not chapters:
+            return moved
+
+        await chapter_body_collection.bulk_write([
+            ReplaceOne({"_id": chapter["_id"]}, {
+                "novel_id": chapter["novel_id"],
+                "data": compress_text(chapter["content"])
+            }, upsert=True)
+            for chapter in chapters
+        ], ordered=False)
+        await chapter_collection.update_many(
+            {"_id": {"$in": [chapter["_id"] for chapter in chapters]}},
+            {"$unset": {"content": ""}}
+        )
+        moved += len(chapters)
+
+        for novel_id in {chapter["novel_id"] for chapter in chapters}:
+            await invalidate_book(novel_id)
+
+
+def rating_summary(book):
+    # rating_sum/rating_count are maintained on the novel by add_rating
+    count = book.get("rating_count", 0)
+    return {
+        "averageRating": book["rating_sum"] / count if count else 0,
+        "ratingCount": count
+    }
+
+
+@cached(ttl=30)
+async def get_rating(book_id):
+    book = await book_collection.find_one(
+        {"_id": ObjectId(book_id)},
+        {"rating_sum": 1, "rating_count": 1}
+    )
+
+    if book:
+        return rating_summary(book)
     else:
         return {"averageRating": 0, "ratingCount": 0}
 
@@ -91,16 +223,17 @@ async def get_comment(book_id: str, limit=10):
         {"novel_id": ObjectId(book_id)}
     ).sort("timestamp", -1).limit(limit)
 
-    comments = []
-    async for comment in comments_cursor:
+    comments = await comments_cursor.to_list(None)
+    return await format_comments(comments)
 
-        user = await get_user(_id=comment["user_id"])
-        comment["user"] = user["name"] if user["name"] else user["username"]
 
-        comment["_id"] = str(comment["_id"])
-        comment["novel_id"] = str(comment["novel_id"])
-        comment["user_id"] = str(comment["user_id"])
-        comments.append(comment)
+async def format_comments(comments, loader=None):
+    # resolve every author on the page with one query
+    loader = loader or UserSummaryLoader()
+    users = await loader.load_many(comment["user_id"] for comment in comments)
+
+    for comment, user in zip(comments, users):
+        comment["user"] = user["name"] if user else "Unknown"
 
     return comments
 
@@ -119,7 +252,7 @@ async def get_history(limit=20, author=None):
     result = []
     async for book in books:
         result.append({
-            "_id": str(book["_id"]),
+            "_id": book["_id"],
             "title": book.get("title", ""),
             "is_valid": book["is_valid"],
             "is_approved": book["is_approved"],
@@ -129,12 +262,31 @@ async def get_history(limit=20, author=None):
     return result
 
 
-async def get_books(is_approved=True, is_valid=True, limit=20, title=None, genre=None, author=None, sort_by=None):
+BOOK_SORTS = {
+    "updated_at": "updated_at",
+    "rating": "rating_avg",
+    "trending": "trending",
+}
+
+# trending score of a novel nobody has viewed yet; every novel carries the
+# field so keyset pages over trending never skip unviewed novels
+TRENDING_FLOOR = -1e18
+
+
+async def get_books(**kargs):
+    books, _ = await get_books_page(**kargs)
+    return books
+
+
+async def get_books_page(is_approved=True, is_valid=True, limit=20, title=None, genre=None, author=None, sort_by=None, after=None):
     query = {"is_valid": is_valid, "is_approved": is_approved}
 
-    # Add title filter
+    # Add title search, ranked by relevance over the normalized search fields
     if title:
-        query["title"] = {"$regex": title, "$options": "i"}
+        terms = search_terms(title)
+        if not terms:
+            return [], None
+        query["$text"] = {"$search": terms}
 
     # Add genre filter
     if genre:
@@ -147,40 +299,193 @@ async def get_books(is_approved=True, is_valid=True, limit=20, title=None, genre
         except Exception as e:
             raise ValueError(f"Invalid author ID: {author}") from e
 
-    books = book_collection.find(query).limit(limit)
+    if title:
+        # text scores can't seed a range query, so search pages by offset
+        offset = 0
+        if after:
+            offset, _ = decode_cursor(after)
+            if not isinstance(offset, int) or offset < 0:
+                raise ValueError(f"Invalid cursor: {after}")
+
+        books = book_collection.find(query, {"score": {"$meta": "textScore"}}).sort(
+            [("score", {"$meta": "textScore"}), ("_id", -1)]).skip(offset).limit(limit)
+    else:
+        sort_field = BOOK_SORTS.get(sort_by, BOOK_SORTS["rating"])
+
+        # keyset paging: continue strictly after the last (sort key, _id) seen
+        if after:
+            value, last_id = decode_cursor(after)
+            try:
+                last_id = ObjectId(last_id)
+            except Exception as e:
+                raise ValueError(f"Invalid cursor: {after}") from e
+            query["$or"] = [
+                {sort_field: {"$lt": value}},
+                {sort_field: value, "_id": {"$lt": last_id}}
+            ]
+
+        books = book_collection.find(query).sort(
+            [(sort_field, -1), ("_id", -1)]).limit(limit)
 
     result = []
+    last = None
     async for book in books:
-        book["rating"] = await get_rating(book["_id"])
-
+        last = book
         result.append({
-            "_id": str(book["_id"]),
+            "_id": book["_id"],
             "title": book.get("title", ""),
             "cover": book.get("cover", ""),
-            "rating": book["rating"],
+            "rating": rating_summary(book),
             "is_valid": book["is_valid"],
             "is_approved": book["is_approved"],
             "updated_at": book.get("updated_at", ""),
         })
 
-    # Sort the books based on the sort_by parameter
-    if sort_by == "updated_at":
-        result.sort(key=lambda x: x["updated_at"], reverse=True)
-    else:
-        result.sort(key=lambda x: x["rating"]["averageRating"], reverse=True)
+    next_cursor = None
+    if last and len(result) == limit:
+        value = offset + limit if title else last.get(sort_field)
+        next_cursor = encode_cursor(value, last["_id"])
 
-    return result
+    return result, next_cursor
+
+
+def search_fields(title, description, author_name):
+    # diacritic-free copies of the searchable text, covered by the text index
+    return {
+        "search_title": search_terms(title),
+        "search_text": search_terms(f"{description} {author_name}"),
+    }
+
+
+async def index_book_search(book_ids):
+    # refresh the search fields from the current title, description and pen name
+    books = await book_collection.find(
+        {"_id": {"$in": [ObjectId(_id) for _id in book_ids]}},
+        {"title": 1, "description": 1, "author": 1}
+    ).to_list(None)
+    authors = await get_user_summaries(book["author"] for book in books)
+
+    updates = []
+    for book in books:
+        author = authors.get(str(book["author"]))
+        updates.append(UpdateOne({"_id": book["_id"]}, {"$set": search_fields(
+            book.get("title", ""),
+            book.get("description", ""),
+            author["name"] if author else ""
+        )}))
+
+    if updates:
+        await book_collection.bulk_write(updates, ordered=False)
+
+    return len(updates)
+
+
+async def load_suggestions():
+    # rebuild the typeahead index from every approved novel
+    books = await book_collection.find(
+        {"is_valid": True, "is_approved": True},
+        {"title": 1, "author": 1}
+    ).to_list(None)
+    authors = await get_user_summaries(book["author"] for book in books)
+
+    suggest.index.replace(
+        (book["_id"], book.get("title", ""), book["author"],
+         authors[str(book["author"])]["name"] if str(book["author"]) in authors else "")
+        for book in books
+    )
+
+    return len(books)
+
+
+async def reindex_search():
+    book_ids = [book["_id"] async for book in book_collection.find({}, {"_id": 1})]
+
+    count = 0
+    for i in range(0, len(book_ids), 500):
+        count += await index_book_search(book_ids[i:i + 500])
+
+    return count
 
 
 async def get_user(**kargs):
     user = await user_collection.find_one(kargs)
     if user and user["is_active"]:
-        user["_id"] = str(user["_id"])
         return user
 
     return None
 
 
+async def get_user_summaries(user_ids):
+    # display name and avatar for each id, including deactivated users
+    ids = list({ObjectId(_id) for _id in user_ids})
+
+    summaries = {}
+    async for user in user_collection.find({"_id": {"$in": ids}}, {"name": 1, "username": 1, "avt": 1}):
+        summaries[str(user["_id"])] = {
+            "_id": user["_id"],
+            "name": user.get("name") or user["username"],
+            "avt": user.get("avt", ""),
+        }
+
+    return summaries
+
+
+class UserSummaryLoader:
+    """
+    Batches user summary lookups made in the same event loop tick into one
+    get_user_summaries query, and remembers every id it has resolved.
+    Create one per request.
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._pending = {}
+        self._tasks = set()
+
+    def load(self, user_id):
+        user_id = str(user_id)
+        if user_id in self._futures:
+            return self._futures[user_id]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._futures[user_id] = future
+        self._pending[user_id] = future
+        if len(self._pending) == 1:
+            loop.call_soon(self._start_dispatch)
+        return future
+
+    async def load_many(self, user_ids):
+        return await asyncio.gather(*(self.load(_id) for _id in user_ids))
+
+    def _start_dispatch(self):
+        # the loop holds tasks weakly, so keep this one until it is done
+        task = asyncio.ensure_future(self._dispatch())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self):
+        pending, self._pending = self._pending, {}
+        try:
+            summaries = await get_user_summaries(pending.keys())
+        except Exception as e:
+            for future in pending.values():
+                future.set_exception(e)
+            return
+
+        for user_id, future in pending.items():
+            future.set_result(summaries.get(user_id))
+
+
+@cached(ttl=30, maxsize=4096)
+async def get_principal(username):
+    # the authenticated user behind a token, without the password hash
+    user = await get_user(username=username)
+    if user:
+        user.pop("hashed_password", None)
+    return user
+
+
 async def create_user(user, hashed_password):
     # Create a new user document
     new_user = {
@@ -195,7 +500,12 @@ async def create_user(user, hashed_password):
         "create_at": datetime.now()
     }
 
-    result = await user_collection.insert_one(new_user)
+    try:
+        result = await user_collection.insert_one(new_user)
+    except DuplicateKeyError as e:
+        if "email" in (e.details or {}).get("keyPattern", {}):
+            raise ValueError("Email already exists.") from e
+        raise ValueError("Username already exists.") from e
     return result
 
 
@@ -209,9 +519,20 @@ async def active_book(book_id):
         }})
 
     book = await book_collection.find_one({"_id": ObjectId(book_id)})
-    await user_collection.update_one(
+    user = await user_collection.find_one_and_update(
         {"_id": ObjectId(book["author"])},
-        {"$set": {"is_author": True}})
+        {"$set": {"is_author": True}},
+        projection={"username": 1})
+    if user:
+        await get_principal.cache.invalidate(user["username"])
+
+    await index_book_search([book_id])
+
+    authors = await get_user_summaries([book["author"]])
+    author = authors.get(str(book["author"]))
+    suggest.index.add_book(book_id, book["title"], book["author"], author["name"] if author else "")
+
+    await invalidate_book(book_id)
 
 
 async def reject_book(book_id):
@@ -222,81 +543,256 @@ async def reject_book(book_id):
             "updated_at": datetime.now()
         }})
 
+    await invalidate_book(book_id)
+
 
+@cached(ttl=60)
 async def get_reading_book(book_id):
-    book = await book_collection.find_one({"_id": ObjectId(book_id)})
-    if book:
-        number_chapter = 0
-        async for _ in chapter_collection.find({"novel_id": ObjectId(book_id)}):
-            number_chapter += 1
+    book = await book_collection.find_one(
+        {"_id": ObjectId(book_id)},
+        {"title": 1, "chapter_count": 1}
+    )
+    if not book:
+        return None
+
+    number_chapter = book.get("chapter_count")
+    if number_chapter is None:
+        # novels stored before chapter_count existed; count once and keep it
+        number_chapter = await chapter_collection.count_documents(
+            {"novel_id": ObjectId(book_id)})
+        await book_collection.update_one(
+            {"_id": ObjectId(book_id), "chapter_count": {"$exists": False}},
+            {"$set": {"chapter_count": number_chapter}}
+        )
 
     return {"title": book["title"], "numberChapter": number_chapter}
 
 
-async def get_book(book_id, is_valid=True):
-    book = await book_collection.find_one({"_id": ObjectId(book_id), "is_valid": is_valid})
+# fields the write paths keep on a novel for search, sorting and uploads;
+# rating_sum and rating_count are folded into "rating" by get_book_details
+BOOK_INTERNAL_FIELDS = {
+    "search_title": 0,
+    "search_text": 0,
+    "rating_avg": 0,
+    "trending": 0,
+    "views": 0,
+    "upload_total": 0,
+    "upload_complete": 0,
+}
+
+
+@cached(ttl=60)
+async def get_book(book_id, is_valid=True, with_content=False):
+    book = await book_collection.find_one(
+        {"_id": ObjectId(book_id), "is_valid": is_valid}, BOOK_INTERNAL_FIELDS)
 
     if book:
-        # get genres
-        genre_names = []
-        for genre_id in book["genres"]:
-            genre = await genre_collection.find_one({"_id": genre_id})
-            if genre:
-                genre["_id"] = str(genre["_id"])
-                genre_names.append(genre)
-
-        # get author
-        author = await user_collection.find_one({"_id": book["author"]})
-
-        # get chapter
-        chapters = []
-        async for chapter in chapter_collection.find({"novel_id": ObjectId(book_id)}).sort("chapter_number", 1):
-            chapters.append({
-                "chapter_number": chapter["chapter_number"],
-                "content": chapter["content"],
-                "title": chapter["title"]
-            })
-
-        book["_id"] = str(book["_id"])
-        book["rating"] = await get_rating(book["_id"])
-        book["author_id"] = str(book["author"])
-        book["author"] = author["name"] if author["name"] else author["username"]
-        book["genres"] = genre_names
-        book["chapters"] = chapters
+        (book,) = await get_book_details([book], with_content)
 
     return book
 
 
-async def upload_image(file: UploadFile = File(...)):
-    # Create an in-memory byte stream from the uploaded file
-    file_stream = io.BytesIO(await file.read())
+async def get_pending_books(limit=20, with_content=True):
+    books = await book_collection.find(
+        {"is_valid": False, "is_approved": False, "upload_complete": {"$ne": False}},
+        BOOK_INTERNAL_FIELDS
+    ).sort("updated_at", -1).limit(limit).to_list(None)
+
+    return await get_book_details(books, with_content)
+
+
+async def get_book_details(books, with_content=False):
+    # fill in genres, author and chapters for a list of novel documents with
+    # one query each, issued concurrently
+    book_ids = [book["_id"] for book in books]
+    genre_ids = list({genre_id for book in books for genre_id in book["genres"]})
+
+    # get chapters, as a table of contents unless the bodies are asked for
+    projection = {"_id": with_content, "novel_id": 1, "chapter_number": 1, "title": 1, "price": 1}
+    if with_content:
+        projection["content"] = 1
+
+    genres, authors, chapters = await asyncio.gather(
+        genre_collection.find({"_id": {"$in": genre_ids}}).to_list(None),
+        get_user_summaries(book["author"] for book in books),
+        chapter_collection.find({"novel_id": {"$in": book_ids}}, projection)
+        .sort([("novel_id", 1), ("chapter_number", 1)]).to_list(None)
+    )
+
+    genres = {genre["_id"]: genre for genre in genres}
+
+    if with_content:
+        # decompress bodies only when they are actually asked for
+        body_ids = [chapter["_id"] for chapter in chapters if "content" not in chapter]
+        bodies = {}
+        if body_ids:
+            async for body in chapter_body_collection.find({"_id": {"$in": body_ids}}):
+                bodies[body["_id"]] = decompress_text(body["data"])
+        for chapter in chapters:
+            _id = chapter.pop("_id")
+            chapter.setdefault("content", bodies.get(_id, ""))
+
+    chapters_by_book = {book_id: [] for book_id in book_ids}
+    for chapter in chapters:
+        chapters_by_book[chapter.pop("novel_id")].append(chapter)
+
+    for book in books:
+        author = authors.get(str(book["author"]))
+
+        book["chapters"] = chapters_by_book[book["_id"]]
+        book["rating"] = rating_summary(book)
+        book.pop("rating_sum", None)
+        book.pop("rating_count", None)
+        book["author_id"] = book["author"]
+        book["author"] = author["name"] if author else "Unknown"
+        book["genres"] = [genres[genre_id] for genre_id in book["genres"] if genre_id in genres]
+
+    return books
+
 
-    # Upload the file to GridFS asynchronously
-    file_id = await fs.upload_from_stream(file.filename, file_stream)
+async def upload_image(file: UploadFile = File(...)):
+    # Read one byte past the limit to detect oversized uploads
+    data = await file.read(images.MAX_IMAGE_BYTES + 1)
+    if len(data) > images.MAX_IMAGE_BYTES:
+        raise ValueError(f"Image larger than {images.MAX_IMAGE_BYTES} bytes")
+
+    # Decoding and resizing is CPU bound, keep it off the event loop
+    rendered = await asyncio.to_thread(images.make_variants, data)
+
+    # Store every variant but the full JPEG, which becomes the image itself
+    # and records where the others are
+    variants = {name: {"width": rendered[(name, "jpeg")][1]} for name in images.VARIANTS}
+    for (name, fmt), (content, _) in rendered.items():
+        if (name, fmt) == ("full", "jpeg"):
+            continue
+        variants[name][fmt] = await fs.upload_from_stream(
+            f"{file.filename}.{name}.{fmt}", io.BytesIO(content),
+            metadata={"contentType": images.FORMATS[fmt], "variant": name})
+
+    file_id = ObjectId()
+    variants["full"]["jpeg"] = file_id
+    await fs.upload_from_stream_with_id(
+        file_id, file.filename, io.BytesIO(rendered[("full", "jpeg")][0]),
+        metadata={"contentType": images.FORMATS["jpeg"], "variants": variants})
 
     # Return the file's ID for referencing it later
     return str(file_id)
 
 
-async def get_image(file_id: str):
-    # Convert file_id to ObjectId
-    file_id = ObjectId(file_id)
+# hottest covers and thumbnails are kept in memory as encoded bytes
+IMAGE_CACHE = ByteLRU(
+    max_bytes=int(os.getenv("IMAGE_CACHE_BYTES", str(32 * 1024 * 1024))),
+    max_item_bytes=int(os.getenv("IMAGE_CACHE_ITEM_BYTES", str(1024 * 1024)))
+)
+
+# GridFS files are never rewritten, so responses can be cached for good
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@cached(ttl=3600)
+async def get_image_file(file_id):
+    return await db["fs.files"].find_one({"_id": ObjectId(file_id)}, {"length": 1, "metadata": 1})
+
+
+async def get_image(file_id: str, width=None, accept="", if_none_match=None, range_header=None):
+    image = await get_image_file(file_id)
+    if not image:
+        return None
+
+    # Pick the variant to serve; images stored before variants existed are
+    # served as they are
+    metadata = image.get("metadata") or {}
+    if metadata.get("variants"):
+        target_id, media_type = images.pick_variant(metadata["variants"], width, accept)
+        if target_id != image["_id"]:
+            image = await get_image_file(target_id)
+            if not image:
+                return None
+    else:
+        media_type = metadata.get("contentType", "image/jpeg")
+
+    target_id = image["_id"]
+    length = image["length"]
+    headers = {
+        "ETag": f'"{target_id}"',
+        "Cache-Control": IMAGE_CACHE_CONTROL,
+        "Vary": "Accept",
+        "Accept-Ranges": "bytes",
+    }
+
+    if if_none_match:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if "*" in tags or headers["ETag"] in tags:
+            return Response(status_code=304, headers=headers)
+
+    try:
+        byte_range = parse_range(range_header, length)
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{length}"})
+
+    status_code = 200
+    start, end = 0, length - 1
+    if byte_range:
+        status_code = 206
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+
+    data = IMAGE_CACHE.get(target_id)
+    if data is None:
+        # another worker may have deleted the file since its metadata was cached
+        try:
+            file_stream = await fs.open_download_stream(target_id)
+        except NoFile:
+            return None
+        if length <= IMAGE_CACHE.max_item_bytes:
+            data = await file_stream.read()
+            IMAGE_CACHE.set(target_id, data)
+
+    if data is not None:
+        return Response(data[start:end + 1], status_code=status_code, media_type=media_type, headers=headers)
+
+    # Large files are streamed from GridFS, starting at the requested offset
+    file_stream.seek(start)
+
+    async def read_range(remaining):
+        while remaining > 0:
+            chunk = await file_stream.read(min(remaining, 256 * 1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(read_range(end - start + 1), status_code=status_code,
+                             media_type=media_type, headers=headers)
+
 
-    # Open the file from GridFS asynchronously
-    file_stream = await fs.open_download_stream(file_id)
+async def delete_image(file_id):
+    try:
+        file_id = ObjectId(file_id)
+    except Exception:
+        return
+
+    image = await db["fs.files"].find_one({"_id": file_id}, {"metadata": 1})
+    if not image:
+        return
 
-    # Return the file as a streaming response (e.g., for images)
-    return StreamingResponse(file_stream, media_type="image/jpeg")
+    variants = (image.get("metadata") or {}).get("variants", {})
+    file_ids = {file_id} | {variant[fmt] for variant in variants.values()
+                            for fmt in images.FORMATS if variant.get(fmt)}
+    for _id in file_ids:
+        await fs.delete(_id)
+
+    # stop serving the files from memory, here and through the shared cache
+    for _id in file_ids:
+        IMAGE_CACHE.discard(_id)
+        await get_image_file.cache.invalidate(_id)
 
 
 async def store_chapter(chapter, user_id):
     book = await book_collection.find_one({"_id": ObjectId(chapter.novelId)})
 
-    if (str(book["author"]) == user_id):
-        await book_collection.update_one(
-            {"_id": ObjectId(chapter.novelId)},
-            {"$set": {"updated_at": datetime.now()}}
-        )
+    if book["author"] == ObjectId(user_id):
         new_chapter = {
             "novel_id": ObjectId(chapter.novelId),
             "chapter_number": chapter.chapterNumber,
@@ -305,14 +801,92 @@ async def store_chapter(chapter, user_id):
             "price": chapter.price
         }
 
-        chapter_result = await chapter_collection.insert_one(new_chapter)
+        await store_chapter_bodies([new_chapter])
+        try:
+            chapter_result = await chapter_collection.insert_one(new_chapter)
+        except DuplicateKeyError as e:
+            await chapter_body_collection.delete_one({"_id": new_chapter["_id"]})
+            raise ValueError(f"Chapter {chapter.chapterNumber} already exists") from e
+
+        update = {"$set": {"updated_at": datetime.now()}}
+        if "chapter_count" in book:
+            update["$inc"] = {"chapter_count": 1}
+        await book_collection.update_one(
+            {"_id": ObjectId(chapter.novelId)}, update)
+
+        await invalidate_book(chapter.novelId)
 
         return str(chapter_result)
     return None
 
 
+async def store_chapters(chapters, user_id):
+    # chapters: list of models.ChapterInsert for one novel, written in order
+    # with a single bulk_write; returns None if the novel isn't the user's
+    novel_id = ObjectId(chapters[0].novelId)
+    book = await book_collection.find_one({"_id": novel_id}, {"author": 1, "chapter_count": 1})
+    if not book or book["author"] != ObjectId(user_id):
+        return None
+
+    docs = [{
+        "novel_id": novel_id,
+        "chapter_number": chapter.chapterNumber,
+        "title": chapter.chapterName,
+        "content": chapter.content,
+        "price": chapter.price
+    } for chapter in chapters]
+
+    # ordered: the first failure, e.g. a duplicate chapter number caught by
+    # the unique index, stops the rest
+    await store_chapter_bodies(docs)
+    failed_index, failure = len(docs), None
+    try:
+        await chapter_collection.bulk_write([InsertOne(doc) for doc in docs], ordered=True)
+    except BulkWriteError as e:
+        error = e.details["writeErrors"][0]
+        failed_index = error["index"]
+        failure = "duplicate" if error["code"] == 11000 else error["errmsg"]
+
+        # bodies of the chapters that were not written
+        await chapter_body_collection.delete_many(
+            {"_id": {"$in": [doc["_id"] for doc in docs[failed_index:]]}})
+
+    results = []
+    for i, doc in enumerate(docs):
+        if i < failed_index:
+            results.append({"chapterNumber": doc["chapter_number"], "status": "inserted",
+                            "chapter_id": str(doc["_id"])})
+        elif i == failed_index:
+            results.append({"chapterNumber": doc["chapter_number"], "status": "error",
+                            "error": failure})
+        else:
+            results.append({"chapterNumber": doc["chapter_number"], "status": "skipped"})
+
+    if failed_index:
+        update = {"$set": {"updated_at": datetime.now()}}
+        if "chapter_count" in book:
+            update["$inc"] = {"chapter_count": failed_index}
+        await book_collection.update_one({"_id": novel_id}, update)
+
+        await invalidate_book(novel_id)
+
+    return results
+
+
+CHAPTER_BATCH_SIZE = 50
+
+
 async def store_temp_novel(book, user_id):
+    novel_id = await create_novel(book, user_id, chapter_count=len(book.chapters))
+
+    for i in range(0, len(book.chapters), CHAPTER_BATCH_SIZE):
+        await chapter_collection.insert_many(await store_chapter_bodies(
+            chapter_docs(novel_id, book.chapters[i:i + CHAPTER_BATCH_SIZE], i)))
 
+    return str(novel_id)
+
+
+async def create_novel(book, user_id, chapter_count, upload_total=None):
     novel = {
         "title": book.bookName,
         "author": ObjectId(user_id),
@@ -322,35 +896,143 @@ async def store_temp_novel(book, user_id):
         "created_at": datetime.now(),
         "updated_at": datetime.now(),
         "is_valid": False,
-        "is_approved": False
+        "is_approved": False,
+        "rating_sum": 0,
+        "rating_count": 0,
+        "rating_avg": 0,
+        "trending": TRENDING_FLOOR,
+        "chapter_count": chapter_count
     }
 
+    # streamed uploads stay out of review until every chapter has arrived
+    if upload_total is not None:
+        novel["upload_total"] = upload_total
+        novel["upload_complete"] = False
+
     novel_result = await book_collection.insert_one(novel)
-    novel_id = novel_result.inserted_id
 
-    chapters = []
-    for i, chapter in enumerate(book.chapters):
-        chapters.append({
-            "novel_id": novel_id,
-            "chapter_number": i + 1,
-            "title": chapter.chapterName,
-            "content": chapter.content,
-            "price": chapter.price
-        })
+    await update_genre_stats(novel["genres"], 1)
+    await update_novel_stats(novel["created_at"], 1)
+    await get_genre_stats.cache.invalidate()
+
+    return novel_result.inserted_id
+
+
+def chapter_docs(novel_id, chapters, stored):
+    # number chapters on from the `stored` ones already saved
+    return [{
+        "novel_id": novel_id,
+        "chapter_number": stored + i + 1,
+        "title": chapter.chapterName,
+        "content": chapter.content,
+        "price": chapter.price
+    } for i, chapter in enumerate(chapters)]
+
+
+async def store_novel_stream(header, chapters, user_id):
+    # chapters: async iterator of models.ChapterLine, read and stored in
+    # batches of CHAPTER_BATCH_SIZE so memory stays bounded
+    if header.novelId:
+        novel = await book_collection.find_one(
+            {"_id": ObjectId(header.novelId), "author": ObjectId(user_id)})
+        if not novel or novel.get("upload_complete", True):
+            raise ValueError(f"No unfinished upload for novel: {header.novelId}")
+
+        novel_id = novel["_id"]
+        total = novel["upload_total"]
+        # count what actually landed, in case the last batch was cut short
+        received = await chapter_collection.count_documents({"novel_id": novel_id})
+    else:
+        total = header.numberOfChapters
+        novel_id = await create_novel(header, user_id, chapter_count=0, upload_total=total)
+        received = 0
+
+    batch = []
+    error = None
+    # a line without chapterNumber follows the line before it, so a resumed
+    # upload that replays the novel from chapter 1 skips what is stored
+    number = 0
+    try:
+        async for chapter in chapters:
+            number = chapter.chapterNumber or number + 1
+            if number <= received:
+                # already stored before the upload was resumed
+                continue
+            if number != received + len(batch) + 1:
+                raise ValueError(f"Expected chapter {received + len(batch) + 1}, got {number}")
+            if number > total:
+                raise ValueError(f"Novel has only {total} chapters")
+
+            batch.append(chapter)
+            if len(batch) == CHAPTER_BATCH_SIZE:
+                received = await append_chapters(novel_id, batch, received, total)
+                batch = []
+    except ValueError as e:
+        error = str(e)
+
+    if batch:
+        received = await append_chapters(novel_id, batch, received, total)
+
+    progress = {
+        "novel_id": str(novel_id),
+        "received": received,
+        "total": total,
+        "complete": received == total
+    }
+    if error:
+        progress["error"] = error
+    return progress
 
-    await chapter_collection.insert_many(chapters)
 
-    return str(novel_id)
+async def append_chapters(novel_id, chapters, received, total):
+    await chapter_collection.insert_many(
+        await store_chapter_bodies(chapter_docs(novel_id, chapters, received)))
+    received += len(chapters)
+
+    await book_collection.update_one(
+        {"_id": novel_id},
+        {"$set": {
+            "chapter_count": received,
+            "upload_complete": received == total,
+            "updated_at": datetime.now()
+        }}
+    )
+    return received
+
+
+async def get_upload_progress(book_id, user_id):
+    novel = await book_collection.find_one(
+        {"_id": ObjectId(book_id), "author": ObjectId(user_id)},
+        {"chapter_count": 1, "upload_total": 1, "upload_complete": 1}
+    )
+    if not novel:
+        return None
+
+    return {
+        "novel_id": str(novel["_id"]),
+        "received": novel.get("chapter_count", 0),
+        "total": novel.get("upload_total", novel.get("chapter_count", 0)),
+        "complete": novel.get("upload_complete", True)
+    }
 
 
 async def delete_novel_and_chapters(book_id: str):
     book = await book_collection.find_one({"_id": ObjectId(book_id)})
-    await db["fs.files"].delete_one({"_id": book["cover"]})
-    await db["fs.chunks"].delete_many({"files_id": book["cover"]})
+    await delete_image(book["cover"])
 
-    await book_collection.delete_one({"_id": ObjectId(book_id)})
+    deleted = await book_collection.delete_one({"_id": ObjectId(book_id)})
     chapters_deleted = await chapter_collection.delete_many(
         {"novel_id": ObjectId(book_id)})
+    await chapter_body_collection.delete_many({"novel_id": ObjectId(book_id)})
+
+    if deleted.deleted_count:
+        await update_genre_stats(book["genres"], -1)
+        await update_novel_stats(book["created_at"], -1)
+
+    suggest.index.remove_book(book_id)
+
+    await invalidate_book(book_id)
+    await get_genre_stats.cache.invalidate()
 
     return str(chapters_deleted)
 
@@ -360,27 +1042,87 @@ async def add_rating(book_id: str, user_id: str, star: int):
         if not (0 <= star <= 5):
             raise ValueError("Rating must be between 0 and 5")
 
-        existing_rating = await rating_collection.find_one({
-            "novel_id": ObjectId(book_id),
-            "user_id": ObjectId(user_id)
-        })
-
-        if existing_rating:
-            return None
-
         rating_doc = {
             "novel_id": ObjectId(book_id),
             "user_id": ObjectId(user_id),
             "rating": star
         }
 
-        result = await rating_collection.insert_one(rating_doc)
+        # the unique (novel_id, user_id) index rejects a second rating
+        try:
+            result = await rating_collection.insert_one(rating_doc)
+        except DuplicateKeyError:
+            return None
+
+        # keep the rating summary on the novel in step, atomically
+        await book_collection.update_one(
+            {"_id": ObjectId(book_id)},
+            [
+                {"$set": {
+                    "rating_sum": {"$add": [{"$ifNull": ["$rating_sum", 0]}, star]},
+                    "rating_count": {"$add": [{"$ifNull": ["$rating_count", 0]}, 1]}
+                }},
+                {"$set": {
+                    "rating_avg": {"$divide": ["$rating_sum", "$rating_count"]}
+                }}
+            ]
+        )
+
+        await get_rating.cache.invalidate(book_id)
+        await get_book.cache.invalidate(book_id)
 
         return str(result.inserted_id)
     except Exception as e:
         raise Exception(f"Failed to add rating: {str(e)}")
 
 
+async def backfill_trending():
+    # novels created before trending existed and never viewed since
+    result = await book_collection.update_many(
+        {"trending": {"$exists": False}},
+        {"$set": {"trending": TRENDING_FLOOR}}
+    )
+    return result.modified_count
+
+
+async def reconcile_ratings():
+    # rebuild rating_sum/rating_count/rating_avg on every novel from ratings
+    pipeline = [
+        {
+            "$group": {
+                "_id": "$novel_id",
+                "rating_sum": {"$sum": "$rating"},
+                "rating_count": {"$sum": 1}
+            }
+        }
+    ]
+
+    summaries = {}
+    async for result in rating_collection.aggregate(pipeline):
+        summaries[result["_id"]] = result
+
+    updates = []
+    async for book in book_collection.find({}, {"_id": 1}):
+        summary = summaries.get(book["_id"], {"rating_sum": 0, "rating_count": 0})
+        count = summary["rating_count"]
+        updates.append(UpdateOne(
+            {"_id": book["_id"]},
+            {"$set": {
+                "rating_sum": summary["rating_sum"],
+                "rating_count": count,
+                "rating_avg": summary["rating_sum"] / count if count else 0
+            }}
+        ))
+
+    if updates:
+        await book_collection.bulk_write(updates, ordered=False)
+
+    await get_rating.cache.invalidate()
+    await get_book.cache.invalidate()
+
+    return len(updates)
+
+
 async def add_comment(book_id: str, user_id: str, comment: str):
     try:
         comment_doc = {
@@ -397,37 +1139,147 @@ async def add_comment(book_id: str, user_id: str, comment: str):
         raise Exception(f"Failed to add rating: {str(e)}")
 
 
+async def update_password(user_id: str, hashed_password: str):
+    await user_collection.update_one(
+        {"_id": ObjectId(user_id)},
+        {"$set": {"hashed_password": hashed_password}}
+    )
+
+
 async def update_user_name(user_id: str, name: str):
     user_id_obj = ObjectId(user_id)
 
-    await user_collection.update_one(
+    user = await user_collection.find_one_and_update(
         {"_id": user_id_obj},
-        {"$set": {"name": name}}
+        {"$set": {"name": name}},
+        {"username": 1}
     )
 
+    if user:
+        await get_principal.cache.invalidate(user["username"])
+        suggest.index.rename_author(user_id, name or user["username"])
 
-async def get_genre_stats():
-    stats = []
-    genres = genre_collection.find()
+    # the pen name is part of the searchable text of the author's novels
+    book_ids = [book["_id"] async for book in book_collection.find({"author": user_id_obj}, {"_id": 1})]
+    await index_book_search(book_ids)
+
+    # the pen name is shown on every book detail of this author
+    await get_book.cache.invalidate()
 
-    async for genre in genres:
-        count = await book_collection.count_documents(
-            {"genres": genre["_id"]})
 
+@cached(ttl=60)
+async def get_genre_stats():
+    if MATERIALIZED_GENRE_STATS:
+        # genre metadata joined to the counters kept by the write paths
+        genres = await genre_collection.aggregate([
+            {"$lookup": {
+                "from": "genre_stats",
+                "localField": "_id",
+                "foreignField": "_id",
+                "as": "stats"
+            }}
+        ]).to_list(None)
+        counts = {genre["_id"]: genre["stats"][0]["count"]
+                  for genre in genres if genre["stats"]}
+    else:
+        genres, counts = await asyncio.gather(
+            genre_collection.find().to_list(None),
+            count_novels_by_genre()
+        )
+
+    stats = []
+    for genre in genres:
         stats.append({
             "genre": {
-                "id": str(genre["_id"]),
+                "id": genre["_id"],
                 "name": genre["name"],
                 "description": genre["description"],
             },
-            "count": count
+            "count": counts.get(genre["_id"], 0)
         })
 
     return stats
 
 
-async def get_novel_stats():
+async def count_novels_by_genre():
     pipeline = [
+        {"$unwind": "$genres"},
+        {"$group": {"_id": "$genres", "count": {"$sum": 1}}}
+    ]
+
+    counts = {}
+    async for result in book_collection.aggregate(pipeline):
+        counts[result["_id"]] = result["count"]
+
+    return counts
+
+
+async def update_genre_stats(genre_ids, delta):
+    updates = [
+        UpdateOne({"_id": genre_id}, {"$inc": {"count": delta}}, upsert=True)
+        for genre_id in genre_ids
+    ]
+    if updates:
+        await genre_stats_collection.bulk_write(updates, ordered=False)
+
+
+async def rebuild_genre_stats():
+    counts = await count_novels_by_genre()
+
+    updates = [
+        UpdateOne({"_id": genre_id}, {"$set": {"count": count}}, upsert=True)
+        for genre_id, count in counts.items()
+    ]
+    if updates:
+        await genre_stats_collection.bulk_write(updates, ordered=False)
+
+    await genre_stats_collection.delete_many({"_id": {"$nin": list(counts)}})
+    await get_genre_stats.cache.invalidate()
+
+    return len(counts)
+
+
+async def get_novel_stats(start=None, end=None, granularity="day"):
+    if granularity not in ("day", "week", "month"):
+        raise ValueError(f"Invalid granularity: {granularity}")
+
+    # daily buckets are keyed by their "%Y-%m-%d" date, which sorts by time
+    query = {}
+    if start:
+        query.setdefault("_id", {})["$gte"] = start.strftime("%Y-%m-%d")
+    if end:
+        query.setdefault("_id", {})["$lte"] = end.strftime("%Y-%m-%d")
+
+    buckets = await novel_daily_collection.find(query).sort("_id", 1).to_list(None)
+
+    # roll days up into weeks (starting Monday) or months
+    stats = {}
+    for bucket in buckets:
+        if not bucket["count"]:
+            continue
+        day = datetime.strptime(bucket["_id"], "%Y-%m-%d")
+        if granularity == "week":
+            key = (day - timedelta(days=day.weekday())).strftime("%Y-%m-%d")
+        elif granularity == "month":
+            key = day.strftime("%Y-%m")
+        else:
+            key = bucket["_id"]
+        stats[key] = stats.get(key, 0) + bucket["count"]
+
+    return [{"date": date, "count": count} for date, count in stats.items()]
+
+
+async def update_novel_stats(created_at, delta):
+    await novel_daily_collection.update_one(
+        {"_id": created_at.strftime("%Y-%m-%d")},
+        {"$inc": {"count": delta}},
+        upsert=True
+    )
+
+
+async def rebuild_novel_stats():
+    pipeline = [
+        {"$match": {"created_at": {"$type": "date"}}},
         {
             "$project": {
                 "date": {
@@ -443,17 +1295,21 @@ async def get_novel_stats():
                 "_id": "$date",
                 "count": {"$sum": 1}
             }
-        },
-        {
-            "$sort": {"_id": 1}  # Sort by date in ascending order
         }
     ]
 
     stats = await book_collection.aggregate(pipeline).to_list(None)
-    formatted_stats = [{"date": stat["_id"],
-                        "count": stat["count"]} for stat in stats]
 
-    return formatted_stats
+    updates = [
+        UpdateOne({"_id": stat["_id"]}, {"$set": {"count": stat["count"]}}, upsert=True)
+        for stat in stats
+    ]
+    if updates:
+        await novel_daily_collection.bulk_write(updates, ordered=False)
+
+    await novel_daily_collection.delete_many({"_id": {"$nin": [stat["_id"] for stat in stats]}})
+
+    return len(updates)
 
 
 async def toggle_user_active(user_id):
@@ -467,6 +1323,8 @@ async def toggle_user_active(user_id):
             {"$set": {"is_active": new_status}}
         )
 
+        await get_principal.cache.invalidate(user["username"])
+
 
 async def delete_comment(comment_id):
     await comment_collection.delete_one({"_id": ObjectId(comment_id)})
@@ -475,15 +1333,5 @@ async def delete_comment(comment_id):
 async def get_comments():
     comments_cursor = comment_collection.find().sort("timestamp", -1).limit(20)
 
-    comments = []
-    async for comment in comments_cursor:
-        user = await get_user(_id=comment["user_id"])
-        comment["user"] = user["name"] if user["name"] else user["username"]
-
-        comment["_id"] = str(comment["_id"])
-        comment["novel_id"] = str(comment["novel_id"])
-        comment["user_id"] = str(comment["user_id"])
-
-        comments.append(comment)
-
-    return comments
+    comments = await comments_cursor.to_list(None)
+    return await format_comments(comments)
@@ -0,0 +1,77 @@
+# precomputed homepage feed, served as a ready-encoded JSON snapshot
+
+import os
+import asyncio
+import logging
+
+from datetime import datetime
+
+import dal
+import responses
+
+logger = logging.getLogger(__name__)
+
+FEED_REFRESH_SECONDS = int(os.getenv("FEED_REFRESH_SECONDS", "60"))
+RAIL_SIZE = 12
+
+_snapshot = None
+_lock = asyncio.Lock()
+_changed = asyncio.Event()
+
+
+async def build():
+    genres = await dal.get_genres()
+
+    top_rated, recently_updated, trending, *genre_rails = await asyncio.gather(
+        dal.get_books(sort_by="rating", limit=RAIL_SIZE),
+        dal.get_books(sort_by="updated_at", limit=RAIL_SIZE),
+        dal.get_books(sort_by="trending", limit=RAIL_SIZE),
+        *(dal.get_books(sort_by="rating", genre=genre["_id"], limit=RAIL_SIZE) for genre in genres)
+    )
+
+    feed = {
+        "generated_at": datetime.now(),
+        "top_rated": top_rated,
+        "recently_updated": recently_updated,
+        "trending": trending,
+        "genres": [
+            {"genre": {"_id": genre["_id"], "name": genre["name"]}, "books": books}
+            for genre, books in zip(genres, genre_rails) if books
+        ],
+    }
+    return responses.dumps(feed)
+
+
+async def refresh(force=True):
+    global _snapshot
+    async with _lock:
+        if force or _snapshot is None:
+            _snapshot = await build()
+
+
+async def get_snapshot():
+    # only the first requests of a worker wait, on a single build
+    if _snapshot is None:
+        await refresh(force=False)
+    return _snapshot
+
+
+def mark_changed():
+    # approve/delete events rebuild the snapshot ahead of the next interval
+    _changed.set()
+
+
+async def run():
+    while True:
+        try:
+            await asyncio.wait_for(_changed.wait(), FEED_REFRESH_SECONDS)
+            # let a burst of events settle into one rebuild
+            await asyncio.sleep(1)
+        except asyncio.TimeoutError:
+            pass
+        _changed.clear()
+
+        try:
+            await refresh()
+        except Exception as e:
+            logger.error("Failed to rebuild the home feed: %s", e)
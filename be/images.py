@@ -0,0 +1,75 @@
+# cover image processing: validation and resized variants
+
+import io
+import os
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+
+# refuse decompression bombs before decoding them; Pillow itself only
+# raises at twice its MAX_IMAGE_PIXELS, so the size is checked explicitly
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "40000000"))
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# variant name -> max width; images are never upscaled
+VARIANTS = {
+    "thumb": 160,
+    "card": 400,
+    "full": 1200,
+}
+
+FORMATS = {
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+}
+
+
+def make_variants(data):
+    """
+    Validates an uploaded image and renders every variant in every format.
+    Returns {(variant, format): (bytes, width)}; raises ValueError on bad input.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        # open only reads the header, so this runs before any decoding
+        if image.width * image.height > MAX_IMAGE_PIXELS:
+            raise ValueError(f"Image is larger than {MAX_IMAGE_PIXELS} pixels")
+        image.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise ValueError("Uploaded file is not a valid image") from e
+
+    # apply EXIF rotation, then drop alpha for JPEG output
+    image = ImageOps.exif_transpose(image).convert("RGB")
+
+    rendered = {}
+    for variant, max_width in VARIANTS.items():
+        resized = image
+        if image.width > max_width:
+            height = round(image.height * max_width / image.width)
+            resized = image.resize((max_width, height), Image.LANCZOS)
+
+        for fmt in FORMATS:
+            out = io.BytesIO()
+            resized.save(out, format=fmt.upper(), quality=82)
+            rendered[(variant, fmt)] = (out.getvalue(), resized.width)
+
+    return rendered
+
+
+def pick_variant(variants, width=None, accept=""):
+    """
+    Chooses the smallest variant at least `width` wide (the largest if none
+    is), in WebP when the client accepts it. Returns (file_id, content_type).
+    """
+    fmt = "webp" if "image/webp" in accept else "jpeg"
+
+    ordered = sorted(variants.values(), key=lambda v: v["width"])
+    chosen = ordered[-1]
+    if width:
+        for variant in ordered:
+            if variant["width"] >= width:
+                chosen = variant
+                break
+
+    return chosen[fmt], FORMATS[fmt]
@@ -0,0 +1,102 @@
+# index declarations and startup bootstrap
+
+import logging
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+from dal import db
+
+logger = logging.getLogger(__name__)
+
+# bump INDEX_VERSION whenever INDEXES changes so running replicas re-apply it
+INDEX_VERSION = 4
+
+INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "novels": [
+        IndexModel([("genres", ASCENDING)], name="genres"),
+        IndexModel([("author", ASCENDING)], name="author"),
+        IndexModel([("is_valid", ASCENDING), ("is_approved", ASCENDING),
+                    ("updated_at", DESCENDING), ("_id", DESCENDING)],
+                   name="listing_updated_at"),
+        IndexModel([("is_valid", ASCENDING), ("is_approved", ASCENDING),
+                    ("rating_avg", DESCENDING), ("_id", DESCENDING)],
+                   name="listing_rating"),
+        IndexModel([("is_valid", ASCENDING), ("is_approved", ASCENDING),
+                    ("trending", DESCENDING), ("_id", DESCENDING)],
+                   name="listing_trending"),
+        # search fields hold diacritic-free text, so no language stemming
+        IndexModel([("search_title", TEXT), ("search_text", TEXT)],
+                   name="search", default_language="none",
+                   weights={"search_title": 10, "search_text": 1}),
+    ],
+    "chapters": [
+        IndexModel([("novel_id", ASCENDING), ("chapter_number", ASCENDING)],
+                   name="novel_chapter_unique", unique=True),
+    ],
+    "chapter_bodies": [
+        IndexModel([("novel_id", ASCENDING)], name="novel"),
+    ],
+    "ratings": [
+        IndexModel([("novel_id", ASCENDING), ("user_id", ASCENDING)],
+                   name="novel_user_unique", unique=True),
+    ],
+    "reading_progress": [
+        IndexModel([("user_id", ASCENDING), ("novel_id", ASCENDING)],
+                   name="user_novel_unique", unique=True),
+    ],
+    "comments": [
+        IndexModel([("novel_id", ASCENDING), ("timestamp", DESCENDING)],
+                   name="novel_timestamp"),
+        IndexModel([("timestamp", DESCENDING)], name="timestamp"),
+    ],
+}
+
+meta_collection = db["meta"]
+
+
+async def ensure_indexes():
+    # create_indexes is a no-op for indexes that already exist with the same
+    # spec, so replicas starting together can all run this safely
+    state = await meta_collection.find_one({"_id": "indexes"})
+    if state and state.get("version", 0) >= INDEX_VERSION:
+        return False
+
+    complete = True
+    for name, models in INDEXES.items():
+        try:
+            await db[name].create_indexes(models)
+        except OperationFailure as e:
+            # e.g. existing duplicates blocking a unique index; keep serving
+            # and retry on the next startup
+            logger.error("Failed to create indexes on %s: %s", name, e)
+            complete = False
+
+    if not complete:
+        return False
+
+    await meta_collection.update_one(
+        {"_id": "indexes"},
+        {"$max": {"version": INDEX_VERSION}},
+        upsert=True
+    )
+    return True
+
+
+async def get_index_usage():
+    usage = []
+    for name, models in INDEXES.items():
+        declared = {model.document["name"] for model in models}
+        async for stat in db[name].aggregate([{"$indexStats": {}}]):
+            usage.append({
+                "collection": name,
+                "index": stat["name"],
+                "ops": stat["accesses"]["ops"],
+                "since": stat["accesses"]["since"],
+                "declared": stat["name"] == "_id_" or stat["name"] in declared,
+            })
+    return usage
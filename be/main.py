@@ -1,9 +1,14 @@
 
 import os
+import asyncio
+import logging
 
+from datetime import date
+from typing import List
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI
-from fastapi import FastAPI, Depends, HTTPException, File, UploadFile
+from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Query, Request, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
@@ -11,8 +16,47 @@ from fastapi.responses import JSONResponse
 import models
 import dal
 import auth
-
-app = FastAPI()
+import cache
+import feed
+import indexes
+import suggest
+import tracking
+import util
+from responses import BSONResponse
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await indexes.ensure_indexes()
+    await cache.configure()
+    await dal.load_suggestions()
+    refresh = asyncio.create_task(refresh_suggestions())
+    flusher = asyncio.create_task(tracking.run_flusher())
+    feed_builder = asyncio.create_task(feed.run())
+    yield
+    refresh.cancel()
+    feed_builder.cancel()
+    flusher.cancel()
+    await asyncio.gather(flusher, return_exceptions=True)
+    await cache.close()
+
+
+# writes update the typeahead index of the worker that served them; a periodic
+# rebuild brings the other workers' indexes in line
+SUGGEST_REFRESH_SECONDS = int(os.getenv("SUGGEST_REFRESH_SECONDS", "300"))
+
+
+async def refresh_suggestions():
+    while True:
+        await asyncio.sleep(SUGGEST_REFRESH_SECONDS)
+        try:
+            await dal.load_suggestions()
+        except Exception as e:
+            logger.error("Failed to refresh suggestions: %s", e)
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=BSONResponse)
+logger = logging.getLogger(__name__)
 load_dotenv()
 
 origins = [
@@ -26,9 +70,11 @@ app.add_middleware(
     allow_origins=origins,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Link"],
 )
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
 
 
 @app.get("/")
@@ -37,9 +83,27 @@ def read_root():
 
 
 @app.get("/books")
-async def get_books(sort: str | None = None, title: str | None = None, author: str | None = None, genre: str | None = None,):
-    books = await dal.get_books(sort_by=sort, title=title, author=author, genre=genre)
-    return books
+async def get_books(sort: str | None = None, title: str | None = None, author: str | None = None, genre: str | None = None,
+                    limit: int = Query(20, ge=1, le=100), after: str | None = None):
+    try:
+        books, next_cursor = await dal.get_books_page(
+            sort_by=sort, title=title, author=author, genre=genre, limit=limit, after=after)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+    # pass the cursor for the next page without changing the list body
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return BSONResponse(books, headers=headers)
+
+
+@app.get("/feed/home")
+async def get_home_feed():
+    return Response(await feed.get_snapshot(), media_type="application/json")
+
+
+@app.get("/suggest")
+async def get_suggestions(q: str, limit: int = Query(10, ge=1, le=20)):
+    return suggest.index.search(q, limit)
 
 
 @app.post("/ratings")
@@ -73,7 +137,7 @@ async def add_comment(input: models.CommentInput, access_token: str = Depends(oa
 @app.get("/comments/{book_id}")
 async def get_comment(book_id: str):
     comments = await dal.get_comment(book_id)
-    return comments
+    return BSONResponse(comments)
 
 
 @app.get("/comments")
@@ -82,7 +146,7 @@ async def get_comments(access_token: str = Depends(oauth2_scheme)):
 
     if user and user["is_admin"]:
         comments = await dal.get_comments()
-        return comments
+        return BSONResponse(comments)
     raise HTTPException(
         status_code=403, detail="You don't have the permission")
 
@@ -95,15 +159,13 @@ async def get_rating(book_id: str):
 
 @app.get("/pending_books")
 async def get_pending_books(access_token: str = Depends(oauth2_scheme)):
-    books = await dal.get_books(is_valid=False, is_approved=False)
     user = await auth.decode_token(access_token)
 
     novels = []
     if user and user["is_admin"]:
-        for book in books:
-            novel = await dal.get_book(book["_id"], is_valid=False)
-            novels.append(novel)
-    return novels
+        # admins review the full text before approving
+        novels = await dal.get_pending_books(with_content=True)
+    return BSONResponse(novels)
 
 
 @app.post("/active-book")
@@ -112,6 +174,7 @@ async def active_book(request: models.PendingBookRequest, access_token: str = De
 
     if user and user["is_admin"]:
         await dal.active_book(request.book_id)
+        feed.mark_changed()
         return {"message": "Book upload successfully!!!"}
     raise HTTPException(
         status_code=403, detail="You don't have the permission")
@@ -132,40 +195,79 @@ async def reject_book(request: models.PendingBookRequest, access_token: str = De
 async def get_author_books(access_token: str = Depends(oauth2_scheme)):
     user = await auth.decode_token(access_token)
     books = await dal.get_books(author=user["_id"])
-    return books
+    return BSONResponse(books)
 
 
 @app.get("/history")
 async def get_history(access_token: str = Depends(oauth2_scheme)):
     user = await auth.decode_token(access_token)
     books = await dal.get_history(author=user["_id"])
-    return books
+    return BSONResponse(books)
 
 
 @app.get("/genres")
 async def get_genres():
     genres = await dal.get_genres()
-    return genres
+    return BSONResponse(genres)
 
 
 @app.get("/books/{book_id}")
 async def get_book(book_id: str):
     book = await dal.get_book(book_id)
-    return book
+    return BSONResponse(book)
 
 
 @app.get("/books/{book_id}/chapters/{chapter_num}")
-async def get_chapter(book_id: str, chapter_num: int):
-    data = await dal.get_chapter(book_id, chapter_num)
-    book = await dal.get_reading_book(book_id)
-    data["book"] = book
-    return data
+async def get_chapter(book_id: str, chapter_num: int,
+                      access_token: str | None = Depends(optional_oauth2_scheme)):
+    dal.record_chapter_read(book_id, chapter_num)
+    data, book = await asyncio.gather(
+        dal.get_chapter(book_id, chapter_num),
+        dal.get_reading_book(book_id)
+    )
+    if not data:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+
+    # anonymous readers count as views; signed-in readers also get progress
+    user = None
+    if access_token:
+        try:
+            user = await auth.decode_token(access_token)
+        except HTTPException:
+            pass
+    tracking.record_view(book_id, chapter_num, user["_id"] if user else None)
+
+    # readers go through chapters in order: load the next ones in the
+    # background and point the client at the next page
+    headers = None
+    if book and chapter_num < book["numberChapter"]:
+        dal.prefetch_chapters(book_id, chapter_num, book["numberChapter"])
+        headers = {"Link": f'</books/{book_id}/chapters/{chapter_num + 1}>; rel="next"'}
+
+    # the chapter comes from the shared cache, so don't mutate it
+    return BSONResponse({**data, "book": book}, headers=headers)
+
+
+@app.get("/books/{book_id}/chapters/{chapter_num}/content")
+async def get_chapter_content(request: Request, book_id: str, chapter_num: int):
+    data = await dal.get_chapter_body(book_id, chapter_num)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+
+    # bodies are stored gzipped, so clients that accept gzip get them as-is
+    headers = {"Vary": "Accept-Encoding"}
+    if util.accepts_encoding(request.headers.get("accept-encoding"), "gzip"):
+        headers["Content-Encoding"] = "gzip"
+    else:
+        data = util.decompress_text(data).encode("utf-8")
+
+    return Response(data, media_type="text/plain; charset=utf-8", headers=headers)
 
 
 @app.get("/user-info")
 async def get_user_info(access_token: str = Depends(oauth2_scheme)):
     user = await auth.decode_token(access_token)
-    return user
+    return BSONResponse(user)
 
 
 @app.post("/login", response_model=models.Token)
@@ -177,7 +279,10 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
 
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
-    file_id = await dal.upload_image(file)
+    try:
+        file_id = await dal.upload_image(file)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
     return JSONResponse(content={"fileId": file_id})
 
 
@@ -194,8 +299,12 @@ async def signup(user: models.User):
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists.")
 
-    hashed_password = auth.hash_password(user.password)
-    await dal.create_user(user, hashed_password)
+    hashed_password = await auth.hash_password(user.password)
+    try:
+        await dal.create_user(user, hashed_password)
+    except ValueError as ve:
+        # lost a race against a concurrent signup, caught by the unique index
+        raise HTTPException(status_code=400, detail=str(ve))
 
     access_token = auth.create_access_token(
         data={"sub": user.username})
@@ -204,8 +313,15 @@ async def signup(user: models.User):
 
 
 @app.get("/image/{file_id}")
-async def get_image(file_id: str):
-    return await dal.get_image(file_id)
+async def get_image(request: Request, file_id: str, w: int | None = Query(None, gt=0)):
+    image = await dal.get_image(
+        file_id, width=w,
+        accept=request.headers.get("accept", ""),
+        if_none_match=request.headers.get("if-none-match"),
+        range_header=request.headers.get("range"))
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return image
 
 
 @app.post("/novels")
@@ -220,6 +336,41 @@ async def store_temp_novel(book: models.Book, access_token: str = Depends(oauth2
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# bound on a single NDJSON line, i.e. one chapter, of a streamed upload
+MAX_UPLOAD_LINE_BYTES = int(os.getenv("MAX_UPLOAD_LINE_BYTES", str(2 * 1024 * 1024)))
+
+
+@app.post("/novels/stream")
+async def store_novel_stream(request: Request, access_token: str = Depends(oauth2_scheme)):
+    user = await auth.decode_token(access_token)
+
+    # first line is a models.NovelUpload, every following line a models.ChapterLine
+    lines = util.iter_ndjson(request.stream(), MAX_UPLOAD_LINE_BYTES)
+    try:
+        header = models.NovelUpload(**await anext(lines))
+        chapters = (models.ChapterLine(**line) async for line in lines)
+        progress = await dal.store_novel_stream(header, chapters, user["_id"])
+    except StopAsyncIteration:
+        raise HTTPException(status_code=400, detail="Empty upload")
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+    # stored batches are kept; resume with novelId set in the header line
+    if "error" in progress:
+        return JSONResponse(status_code=400, content=progress)
+    return progress
+
+
+@app.get("/novels/{book_id}/upload")
+async def get_upload_progress(book_id: str, access_token: str = Depends(oauth2_scheme)):
+    user = await auth.decode_token(access_token)
+
+    progress = await dal.get_upload_progress(book_id, user["_id"])
+    if not progress:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return progress
+
+
 @app.post("/chapter")
 async def store_chapter(chapter: models.ChapterInsert, access_token: str = Depends(oauth2_scheme)):
     user = await auth.decode_token(access_token)
@@ -231,16 +382,42 @@ async def store_chapter(chapter: models.ChapterInsert, access_token: str = Depen
                 status_code=403, detail="The book is not yours")
 
         return {"message": "Book stored successfully", "chapter_id": inserted_id}
+    except HTTPException:
+        raise
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+MAX_BULK_CHAPTERS = 200
+
+
+@app.post("/chapters/bulk")
+async def store_chapters(chapters: List[models.ChapterInsert], access_token: str = Depends(oauth2_scheme)):
+    user = await auth.decode_token(access_token)
+
+    if not chapters or len(chapters) > MAX_BULK_CHAPTERS:
+        raise HTTPException(
+            status_code=400, detail=f"Send between 1 and {MAX_BULK_CHAPTERS} chapters")
+    if len({chapter.novelId for chapter in chapters}) > 1:
+        raise HTTPException(
+            status_code=400, detail="All chapters must belong to one book")
+
+    results = await dal.store_chapters(chapters, user["_id"])
+    if results is None:
+        raise HTTPException(status_code=403, detail="The book is not yours")
+
+    return {"results": results}
+
+
 @app.delete("/novel/{book_id}")
 async def delete_novel_and_chapters(book_id: str, access_token: str = Depends(oauth2_scheme)):
     user = await auth.decode_token(access_token)
 
     if user and user["is_admin"]:
         chapters_deleted = await dal.delete_novel_and_chapters(book_id)
+        feed.mark_changed()
         return {
             "message": "Book and associated chapters deleted successfully",
             "chapters_deleted_count": chapters_deleted
@@ -255,7 +432,7 @@ async def get_users(access_token: str = Depends(oauth2_scheme)):
 
     if user and user["is_admin"]:
         users = await dal.get_users()
-        return users
+        return BSONResponse(users)
     raise HTTPException(
         status_code=403, detail="You don't have the permission")
 
@@ -273,14 +450,32 @@ async def update_user_name(req: models.NameInput, access_token: str = Depends(oa
 
 @app.get("/genre-stats")
 async def get_genre_stats():
-    return await dal.get_genre_stats()
+    return BSONResponse(await dal.get_genre_stats())
+
+
+@app.get("/cache-stats")
+async def get_cache_stats(access_token: str = Depends(oauth2_scheme)):
+    user = await auth.decode_token(access_token)
+
+    if user and user["is_admin"]:
+        return {
+            **cache.get_stats(),
+            "images": dal.IMAGE_CACHE.stats(),
+            "read_ahead": dal.get_read_ahead_stats()
+        }
+    raise HTTPException(
+        status_code=403, detail="You don't have the permission")
 
 
 @app.get("/novel-stats")
-async def get_novel_stats():
-    formatted_stats = await dal.get_novel_stats()
+async def get_novel_stats(start: date | None = Query(None, alias="from"), end: date | None = Query(None, alias="to"),
+                          granularity: str = "day"):
+    try:
+        formatted_stats = await dal.get_novel_stats(start, end, granularity)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
 
-    return JSONResponse(content=formatted_stats)
+    return BSONResponse(formatted_stats)
 
 
 @app.post("/toggle-user-active")
@@ -0,0 +1,75 @@
+# maintenance commands, e.g. `python manage.py reconcile-ratings`
+
+import argparse
+import asyncio
+
+import dal
+import indexes
+
+
+async def reconcile_ratings(args):
+    count = await dal.reconcile_ratings()
+    print(f"Reconciled ratings for {count} novels")
+
+
+async def rebuild_genre_stats(args):
+    count = await dal.rebuild_genre_stats()
+    print(f"Rebuilt stats for {count} genres")
+
+
+async def rebuild_novel_stats(args):
+    count = await dal.rebuild_novel_stats()
+    print(f"Rebuilt {count} daily novel buckets")
+
+
+async def backfill_trending(args):
+    count = await dal.backfill_trending()
+    print(f"Set the trending floor on {count} novels")
+
+
+async def reindex_search(args):
+    count = await dal.reindex_search()
+    print(f"Refreshed search fields for {count} novels")
+
+
+async def compress_chapters(args):
+    count = await dal.compress_chapters()
+    print(f"Compressed {count} chapters into chapter_bodies")
+
+
+async def ensure_indexes(args):
+    applied = await indexes.ensure_indexes()
+    print(f"Index version {indexes.INDEX_VERSION}: " +
+          ("applied" if applied else "already up to date"))
+
+
+async def index_usage(args):
+    # ops are counted since the last mongod restart, per node
+    for stat in await indexes.get_index_usage():
+        flag = "" if stat["declared"] else "  (not declared)"
+        print(f"{stat['collection']}.{stat['index']}: {stat['ops']} ops "
+              f"since {stat['since']:%Y-%m-%d}{flag}")
+
+
+COMMANDS = {
+    "reconcile-ratings": reconcile_ratings,
+    "rebuild-genre-stats": rebuild_genre_stats,
+    "rebuild-novel-stats": rebuild_novel_stats,
+    "backfill-trending": backfill_trending,
+    "reindex-search": reindex_search,
+    "compress-chapters": compress_chapters,
+    "ensure-indexes": ensure_indexes,
+    "index-usage": index_usage,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Novel backend maintenance")
+    parser.add_argument("command", choices=COMMANDS.keys())
+    args = parser.parse_args()
+
+    asyncio.run(COMMANDS[args.command](args))
+
+
+if __name__ == "__main__":
+    main()
@@ -20,15 +20,27 @@ class Chapter(BaseModel):
     price: float = 0
 
 
-class Book(BaseModel):
+class NovelInfo(BaseModel):
     bookName: str
     genres: List[str]
     description: str
     bookCover: str
     numberOfChapters: int = Field(..., gt=0)
+
+
+class Book(NovelInfo):
     chapters: List[Chapter]
 
 
+class NovelUpload(NovelInfo):
+    # set to resume an unfinished upload of this novel
+    novelId: str | None = None
+
+
+class ChapterLine(Chapter):
+    chapterNumber: int | None = None
+
+
 class PendingBookRequest(BaseModel):
     book_id: str
 
@@ -0,0 +1,27 @@
+# JSON responses that understand BSON types, encoded with orjson
+
+import orjson
+
+from bson.objectid import ObjectId
+from fastapi.responses import JSONResponse
+
+
+def bson_default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content):
+    # datetimes are encoded natively by orjson, ObjectIds as their hex string
+    return orjson.dumps(content, default=bson_default)
+
+
+class BSONResponse(JSONResponse):
+    """
+    Encodes documents straight from MongoDB. Return it from a route to skip
+    FastAPI's jsonable_encoder pass.
+    """
+
+    def render(self, content):
+        return dumps(content)
@@ -0,0 +1,117 @@
+# in-memory typeahead index over approved titles and author pen names
+
+from bisect import bisect_left, insort
+
+from util import search_terms
+
+
+def word_suffixes(text):
+    # "duong ve nha" -> "duong ve nha", "ve nha", "nha", so a query can
+    # match the start of any word
+    words = search_terms(text).split()
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
+class SuggestIndex:
+    """
+    Sorted array of normalized keys answered with bisect. Each key points
+    at a book or an author; authors are listed while they have at least one
+    indexed book.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._books = {}
+        self._authors = {}
+
+    def _add_keys(self, text, kind, ref_id):
+        for key in word_suffixes(text):
+            insort(self._keys, (key, kind, ref_id))
+
+    def _remove_keys(self, text, kind, ref_id):
+        for key in word_suffixes(text):
+            entry = (key, kind, ref_id)
+            i = bisect_left(self._keys, entry)
+            if i < len(self._keys) and self._keys[i] == entry:
+                del self._keys[i]
+
+    def add_book(self, book_id, title, author_id, author_name):
+        book_id, author_id = str(book_id), str(author_id)
+        self.remove_book(book_id)
+
+        self._books[book_id] = (title, author_id)
+        self._add_keys(title, "book", book_id)
+
+        author = self._authors.get(author_id)
+        if author is None:
+            author = self._authors[author_id] = {"name": author_name, "books": set()}
+            self._add_keys(author_name, "author", author_id)
+        author["books"].add(book_id)
+
+    def remove_book(self, book_id):
+        book_id = str(book_id)
+        if book_id not in self._books:
+            return
+
+        title, author_id = self._books.pop(book_id)
+        self._remove_keys(title, "book", book_id)
+
+        author = self._authors[author_id]
+        author["books"].discard(book_id)
+        if not author["books"]:
+            self._remove_keys(author["name"], "author", author_id)
+            del self._authors[author_id]
+
+    def rename_author(self, author_id, name):
+        author = self._authors.get(str(author_id))
+        if author is None:
+            return
+
+        self._remove_keys(author["name"], "author", str(author_id))
+        author["name"] = name
+        self._add_keys(name, "author", str(author_id))
+
+    def replace(self, books):
+        # books: iterable of (book_id, title, author_id, author_name);
+        # built aside and sorted once, then swapped in
+        keys, books_by_id, authors = [], {}, {}
+        for book_id, title, author_id, author_name in books:
+            book_id, author_id = str(book_id), str(author_id)
+            books_by_id[book_id] = (title, author_id)
+            keys.extend((key, "book", book_id) for key in word_suffixes(title))
+
+            if author_id not in authors:
+                authors[author_id] = {"name": author_name, "books": set()}
+                keys.extend((key, "author", author_id) for key in word_suffixes(author_name))
+            authors[author_id]["books"].add(book_id)
+
+        keys.sort()
+        self._keys, self._books, self._authors = keys, books_by_id, authors
+
+    def search(self, q, limit=10):
+        q = search_terms(q)
+        if not q:
+            return []
+
+        results = []
+        seen = set()
+        i = bisect_left(self._keys, (q,))
+        while i < len(self._keys) and len(results) < limit:
+            key, kind, ref_id = self._keys[i]
+            if not key.startswith(q):
+                break
+            i += 1
+
+            if (kind, ref_id) in seen:
+                continue
+            seen.add((kind, ref_id))
+
+            if kind == "book":
+                results.append({"type": "book", "id": ref_id, "title": self._books[ref_id][0]})
+            else:
+                results.append({"type": "author", "id": ref_id, "name": self._authors[ref_id]["name"]})
+
+        return results
+
+
+index = SuggestIndex()
@@ -0,0 +1,21 @@
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import cache
+import dal
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    # cached dal reads must not leak between tests
+    monkeypatch.setattr(cache, "backend", cache.MemoryBackend())
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    # in-memory stand-in for every dal collection
+    db = AsyncMongoMockClient()[dal.DATABASE_NAME or "test"]
+    for name in dir(dal):
+        if name.endswith("_collection"):
+            monkeypatch.setattr(dal, name, db[getattr(dal, name).name])
+    return db
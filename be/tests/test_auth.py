@@ -0,0 +1,100 @@
+import time
+import asyncio
+
+import httpx
+import pytest
+from bson.objectid import ObjectId
+from passlib.context import CryptContext
+
+import auth
+import dal
+from main import app
+
+PASSWORD = "correct horse"
+
+
+@pytest.fixture
+def user(monkeypatch):
+    user = {"_id": ObjectId(), "username": "ann", "is_active": True,
+            "hashed_password": auth.pwd_context.hash(PASSWORD)}
+
+    async def get_user(**kwargs):
+        return dict(user) if kwargs.get("username") == user["username"] else None
+
+    monkeypatch.setattr(dal, "get_user", get_user)
+    monkeypatch.setattr(auth, "SECRET_KEY", "test-secret")
+    return user
+
+
+@pytest.fixture
+def client():
+    # no lifespan: these routes need neither MongoDB nor the background tasks
+    transport = httpx.ASGITransport(app=app)
+    return httpx.AsyncClient(transport=transport, base_url="http://test")
+
+
+async def login(client, password=PASSWORD):
+    return await client.post("/login", data={"username": "ann", "password": password})
+
+
+async def test_login(user, client):
+    async with client:
+        assert (await login(client)).status_code == 200
+        assert (await login(client, "wrong")).status_code == 401
+
+
+async def test_reads_stay_fast_while_logins_hash(user, client):
+    started = time.perf_counter()
+    auth.pwd_context.verify(PASSWORD, user["hashed_password"])
+    one_hash = time.perf_counter() - started
+
+    async with client:
+        await client.get("/")
+        logins = asyncio.gather(*(login(client) for _ in range(2 * auth.HASH_WORKERS)))
+
+        latencies = []
+        while not logins.done():
+            started = time.perf_counter()
+            assert (await client.get("/")).status_code == 200
+            latencies.append(time.perf_counter() - started)
+
+        assert all(response.status_code == 200 for response in await logins)
+
+    # with bcrypt on the event loop a read would wait out at least one hash
+    assert len(latencies) > 1
+    assert max(latencies) < one_hash / 2
+
+
+async def test_outdated_hash_is_upgraded_on_login(user, client, monkeypatch):
+    # a stored hash below the context's minimum rounds needs an update
+    monkeypatch.setattr(auth, "pwd_context", CryptContext(
+        schemes=["bcrypt"], deprecated="auto", bcrypt__min_rounds=5, bcrypt__default_rounds=5))
+    user["hashed_password"] = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash(PASSWORD)
+
+    updates = []
+
+    async def update_password(user_id, hashed_password):
+        updates.append((user_id, hashed_password))
+
+    monkeypatch.setattr(dal, "update_password", update_password)
+
+    async with client:
+        assert (await login(client)).status_code == 200
+
+    [(user_id, new_hash)] = updates
+    assert user_id == user["_id"]
+    assert new_hash.startswith("$2b$05$")
+    assert auth.pwd_context.verify(PASSWORD, new_hash)
+
+
+async def test_current_hash_is_not_rewritten(user, client, monkeypatch):
+    updates = []
+
+    async def update_password(user_id, hashed_password):
+        updates.append(user_id)
+
+    monkeypatch.setattr(dal, "update_password", update_password)
+
+    async with client:
+        assert (await login(client)).status_code == 200
+    assert updates == []
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+
+import dal
+
+NOVELS = 23
+
+
+class Untouched:
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        raise AssertionError(f"listing must not query {self.name}.{attr}")
+
+
+@pytest.fixture
+async def queries(mongo, monkeypatch):
+    start = datetime(2024, 1, 1)
+    await mongo["novels"].insert_many([{
+        "_id": ObjectId(),
+        "title": f"Novel {i}",
+        "cover": "",
+        "is_valid": True,
+        "is_approved": True,
+        "updated_at": start + timedelta(hours=i),
+        # few distinct values, so pages break inside runs of equal keys
+        "rating_sum": i % 3 * 4,
+        "rating_count": 4 if i % 3 else 0,
+        "rating_avg": i % 3,
+        "trending": dal.TRENDING_FLOOR if i % 2 else float(i),
+    } for i in range(NOVELS)])
+
+    # ratings, authors and chapters come from the novel document itself
+    for name in ("rating_collection", "user_collection", "chapter_collection"):
+        monkeypatch.setattr(dal, name, Untouched(name))
+
+    queries = []
+    find = dal.book_collection.find
+
+    def counting_find(*args, **kwargs):
+        queries.append(args)
+        return find(*args, **kwargs)
+
+    monkeypatch.setattr(dal.book_collection, "find", counting_find)
+    return queries
+
+
+@pytest.mark.parametrize("limit", [1, 5, 20, 50])
+@pytest.mark.parametrize("sort_by", ["updated_at", "rating", "trending"])
+async def test_one_query_per_page(queries, limit, sort_by):
+    seen, pages, after = [], 0, None
+    while True:
+        books, after = await dal.get_books_page(limit=limit, sort_by=sort_by, after=after)
+        pages += 1
+        seen.extend(book["_id"] for book in books)
+        if not after:
+            break
+
+    assert len(queries) == pages
+    # keyset pages neither skip nor repeat novels, including unviewed ones
+    assert len(seen) == len(set(seen)) == NOVELS
+
+
+async def test_page_rows_carry_the_rating_summary(queries):
+    books, _ = await dal.get_books_page(limit=NOVELS, sort_by="rating")
+
+    assert [book["rating"]["averageRating"] for book in books[:2]] == [2, 2]
+    assert books[-1]["rating"] == {"averageRating": 0, "ratingCount": 0}
+    assert len(queries) == 1
@@ -0,0 +1,197 @@
+import asyncio
+
+import pytest
+import fakeredis
+
+import cache
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def redis_backend(server, **kwargs):
+    return cache.RedisBackend(fakeredis.FakeAsyncRedis(server=server), **kwargs)
+
+
+async def wait_for(condition, timeout=2):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met in time")
+
+
+async def test_memory_get_set_and_expiry(monkeypatch):
+    backend = cache.MemoryBackend()
+    await backend.set("books", ("a",), 1, ttl=10, maxsize=10)
+    assert await backend.get("books", ("a",)) == (True, 1)
+    assert await backend.get("books", ("b",)) == (False, None)
+
+    now = cache.time.monotonic()
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now + 11)
+    assert await backend.get("books", ("a",)) == (False, None)
+
+
+async def test_memory_evicts_least_recently_used():
+    backend = cache.MemoryBackend()
+    await backend.set("books", ("a",), 1, ttl=10, maxsize=2)
+    await backend.set("books", ("b",), 2, ttl=10, maxsize=2)
+    await backend.get("books", ("a",))
+    await backend.set("books", ("c",), 3, ttl=10, maxsize=2)
+
+    assert await backend.get("books", ("a",)) == (True, 1)
+    assert await backend.get("books", ("b",)) == (False, None)
+
+
+async def test_memory_invalidate_prefix():
+    backend = cache.MemoryBackend()
+    await backend.set("chapters", ("a", 1), 1, ttl=10, maxsize=10)
+    await backend.set("chapters", ("a", 2), 2, ttl=10, maxsize=10)
+    await backend.set("chapters", ("b", 1), 3, ttl=10, maxsize=10)
+
+    await backend.invalidate("chapters", ("a",))
+    assert await backend.get("chapters", ("a", 1)) == (False, None)
+    assert await backend.get("chapters", ("a", 2)) == (False, None)
+    assert await backend.get("chapters", ("b", 1)) == (True, 3)
+
+    await backend.invalidate("chapters", ())
+    assert backend.size("chapters") == 0
+
+
+async def test_redis_set_is_shared(server):
+    writer, reader = redis_backend(server), redis_backend(server)
+    await writer.set("books", ("a",), {"title": "x"}, ttl=10, maxsize=10)
+
+    assert await reader.get("books", ("a",)) == (True, {"title": "x"})
+    assert await reader.get("books", ("b",)) == (False, None)
+
+
+async def test_redis_invalidate_prefix_matches_whole_parts(server):
+    backend, other = redis_backend(server), redis_backend(server)
+    await backend.set("chapters", ("a", 1), 1, ttl=10, maxsize=10)
+    await backend.set("chapters", ("a", 2), 2, ttl=10, maxsize=10)
+    await backend.set("chapters", ("ab", 1), 3, ttl=10, maxsize=10)
+    await backend.set("books", ("a",), 4, ttl=10, maxsize=10)
+
+    await backend.invalidate("chapters", ("a",))
+
+    # read through a second backend so its near cache can't answer
+    assert await other.get("chapters", ("a", 1)) == (False, None)
+    assert await other.get("chapters", ("a", 2)) == (False, None)
+    assert await other.get("chapters", ("ab", 1)) == (True, 3)
+    assert await other.get("books", ("a",)) == (True, 4)
+
+
+async def test_redis_invalidate_exact_key_and_everything(server):
+    backend, other = redis_backend(server), redis_backend(server)
+    await backend.set("principal", ("ann",), 1, ttl=10, maxsize=10)
+    await backend.set("principal", ("bob",), 2, ttl=10, maxsize=10)
+
+    await backend.invalidate("principal", ("ann",))
+    assert await other.get("principal", ("ann",)) == (False, None)
+    assert await other.get("principal", ("bob",)) == (True, 2)
+
+    await backend.invalidate("principal", ())
+    assert await redis_backend(server).get("principal", ("bob",)) == (False, None)
+
+
+async def test_redis_invalidate_does_not_scan(server, monkeypatch):
+    backend = redis_backend(server)
+    await backend.set("books", ("a",), 1, ttl=10, maxsize=10)
+
+    def scan_iter(*args, **kwargs):
+        raise AssertionError("invalidate must not scan the keyspace")
+
+    monkeypatch.setattr(backend.client, "scan_iter", scan_iter)
+    await backend.invalidate("books", ("a",))
+
+
+async def test_redis_pubsub_drops_other_workers_near_cache(server):
+    first, second = redis_backend(server), redis_backend(server)
+    await first.start()
+    await second.start()
+    try:
+        await first.set("books", ("a",), 1, ttl=10, maxsize=10)
+        assert await second.get("books", ("a",)) == (True, 1)
+        assert second.near.size("books") == 1
+
+        await first.invalidate("books", ("a",))
+        await wait_for(lambda: second.near.size("books") == 0)
+        assert await second.get("books", ("a",)) == (False, None)
+    finally:
+        await first.stop()
+        await second.stop()
+
+
+async def test_redis_outage_falls_back_to_load(server, monkeypatch):
+    monkeypatch.setattr(cache, "backend", redis_backend(server))
+    server.connected = False
+
+    calls = []
+
+    async def load():
+        calls.append(1)
+        return "from mongo"
+
+    books = cache.Cache("outage_books", ttl=10)
+    assert await books.get(("a",), load) == "from mongo"
+    await books.invalidate("a")
+    assert await books.get(("a",), load) == "from mongo"
+    assert len(calls) == 2
+
+
+class DroppedPubSub:
+    async def listen(self):
+        raise cache.redis.ConnectionError("connection reset")
+        yield
+
+    async def aclose(self):
+        pass
+
+
+async def test_redis_listener_resubscribes_after_disconnect(server, monkeypatch):
+    monkeypatch.setattr(cache.RedisBackend, "RECONNECT_SECONDS", 0.01)
+    first, second = redis_backend(server), redis_backend(server)
+    subscribe = second._subscribe
+
+    async def dropped_once():
+        monkeypatch.setattr(second, "_subscribe", subscribe)
+        return DroppedPubSub()
+
+    monkeypatch.setattr(second, "_subscribe", dropped_once)
+    resubscribed = []
+    monkeypatch.setattr(second, "drop_near", lambda: resubscribed.append(True))
+    await first.start()
+    await second.start()
+    try:
+        await wait_for(lambda: resubscribed)
+        assert not second._listener.done()
+
+        # invalidations reach the worker again after resubscribing
+        await first.set("books", ("a",), 1, ttl=10, maxsize=10)
+        await second.get("books", ("a",))
+        await first.invalidate("books", ("a",))
+        await wait_for(lambda: second.near.size("books") == 0)
+    finally:
+        await first.stop()
+        await second.stop()
+
+
+def test_byte_lru_bounds_total_size_and_discards():
+    lru = cache.ByteLRU(max_bytes=10, max_item_bytes=6)
+    lru.set("a", b"aaaa")
+    lru.set("b", b"bbbb")
+    lru.set("big", b"x" * 7)
+    assert lru.get("big") is None
+
+    lru.get("a")
+    lru.set("c", b"cccc")
+    assert lru.get("b") is None
+    assert lru.get("a") == b"aaaa"
+
+    lru.discard("a")
+    lru.discard("missing")
+    assert lru.get("a") is None
+    assert lru.size == 4
@@ -0,0 +1,48 @@
+import io
+
+import pytest
+from PIL import Image
+
+import images
+
+
+def encode(width, height, fmt="PNG"):
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 30, 30)).save(out, format=fmt)
+    return out.getvalue()
+
+
+def test_make_variants_never_upscales():
+    rendered = images.make_variants(encode(800, 600))
+
+    assert set(rendered) == {(variant, fmt) for variant in images.VARIANTS for fmt in images.FORMATS}
+    assert rendered[("thumb", "webp")][1] == 160
+    assert rendered[("card", "jpeg")][1] == 400
+    assert rendered[("full", "jpeg")][1] == 800
+
+
+def test_make_variants_rejects_non_images():
+    with pytest.raises(ValueError):
+        images.make_variants(b"not an image")
+
+
+def test_make_variants_rejects_images_over_the_pixel_cap(monkeypatch):
+    monkeypatch.setattr(images, "MAX_IMAGE_PIXELS", 100 * 100)
+    images.make_variants(encode(100, 100))
+
+    # just over the cap, well under Pillow's own 2x error threshold
+    with pytest.raises(ValueError):
+        images.make_variants(encode(101, 100))
+
+
+def test_pick_variant():
+    variants = {
+        "thumb": {"width": 160, "webp": "t-w", "jpeg": "t-j"},
+        "card": {"width": 400, "webp": "c-w", "jpeg": "c-j"},
+        "full": {"width": 1200, "webp": "f-w", "jpeg": "f-j"},
+    }
+
+    assert images.pick_variant(variants, 300, "image/webp,*/*") == ("c-w", "image/webp")
+    assert images.pick_variant(variants, 300, "*/*") == ("c-j", "image/jpeg")
+    assert images.pick_variant(variants, 5000, "") == ("f-j", "image/jpeg")
+    assert images.pick_variant(variants) == ("f-j", "image/jpeg")
@@ -0,0 +1,145 @@
+import pytest
+from bson.objectid import ObjectId
+
+import dal
+import models
+
+AUTHOR = ObjectId()
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    # (chapter numbers, contents) of every batch append_chapters received
+    batches = []
+
+    async def append_chapters(novel_id, chapters, received, total):
+        numbers = list(range(received + 1, received + len(chapters) + 1))
+        batches.append((numbers, [chapter.content for chapter in chapters]))
+        return received + len(chapters)
+
+    monkeypatch.setattr(dal, "append_chapters", append_chapters)
+    monkeypatch.setattr(dal, "CHAPTER_BATCH_SIZE", 2)
+    return batches
+
+
+async def unfinished_upload(mongo, received, total):
+    novel_id = ObjectId()
+    await mongo["novels"].insert_one({
+        "_id": novel_id, "author": AUTHOR, "upload_total": total, "upload_complete": False})
+    if received:
+        await mongo["chapters"].insert_many(
+            [{"novel_id": novel_id, "chapter_number": n} for n in range(1, received + 1)])
+    return novel_id
+
+
+def header(novel_id=None, total=6):
+    return models.NovelUpload(bookName="Đường về", genres=[], description="", bookCover="",
+                              numberOfChapters=total, novelId=novel_id and str(novel_id))
+
+
+async def lines(*numbers):
+    # None stands for a line without chapterNumber; content names the line
+    for i, number in enumerate(numbers, 1):
+        yield models.ChapterLine(chapterName=f"Chương {i}", content=f"line {i}",
+                                 chapterNumber=number)
+
+
+def flat(batches):
+    return [(number, content) for numbers, contents in batches
+            for number, content in zip(numbers, contents)]
+
+
+async def test_numbered_replay_skips_stored_chapters(mongo, stored):
+    novel_id = await unfinished_upload(mongo, received=3, total=6)
+
+    progress = await dal.store_novel_stream(header(novel_id), lines(1, 2, 3, 4, 5, 6), str(AUTHOR))
+
+    assert flat(stored) == [(4, "line 4"), (5, "line 5"), (6, "line 6")]
+    assert progress == {"novel_id": str(novel_id), "received": 6, "total": 6, "complete": True}
+
+
+async def test_unnumbered_replay_from_chapter_one_skips_stored_chapters(mongo, stored):
+    novel_id = await unfinished_upload(mongo, received=3, total=6)
+
+    progress = await dal.store_novel_stream(
+        header(novel_id), lines(None, None, None, None, None, None), str(AUTHOR))
+
+    # chapter 4 must hold the fourth line, not the first
+    assert flat(stored) == [(4, "line 4"), (5, "line 5"), (6, "line 6")]
+    assert progress["complete"]
+
+
+async def test_unnumbered_lines_follow_the_previous_number(mongo, stored):
+    novel_id = await unfinished_upload(mongo, received=3, total=6)
+
+    await dal.store_novel_stream(header(novel_id), lines(4, None, None), str(AUTHOR))
+
+    assert flat(stored) == [(4, "line 1"), (5, "line 2"), (6, "line 3")]
+
+
+async def test_gap_stops_the_upload(mongo, stored):
+    novel_id = await unfinished_upload(mongo, received=0, total=6)
+
+    progress = await dal.store_novel_stream(header(novel_id), lines(1, 2, 4, 5), str(AUTHOR))
+
+    assert progress["error"] == "Expected chapter 3, got 4"
+    assert progress["received"] == 2
+    assert not progress["complete"]
+
+
+async def test_chapters_past_the_total_are_rejected(mongo, stored):
+    novel_id = await unfinished_upload(mongo, received=0, total=2)
+
+    progress = await dal.store_novel_stream(header(novel_id, total=2), lines(1, 2, 3), str(AUTHOR))
+
+    assert progress["error"] == "Novel has only 2 chapters"
+    assert flat(stored) == [(1, "line 1"), (2, "line 2")]
+    assert progress["complete"]
+
+
+async def test_partial_batch_is_flushed_after_an_error(mongo, stored):
+    novel_id = await unfinished_upload(mongo, received=0, total=6)
+
+    progress = await dal.store_novel_stream(header(novel_id), lines(1, 2, 3, 5), str(AUTHOR))
+
+    assert [numbers for numbers, _ in stored] == [[1, 2], [3]]
+    assert progress["received"] == 3
+    assert progress["error"] == "Expected chapter 4, got 5"
+
+
+async def test_invalid_chapter_line_keeps_what_came_before(mongo, stored):
+    novel_id = await unfinished_upload(mongo, received=0, total=6)
+
+    async def chapters():
+        async for chapter in lines(1, 2, 3):
+            yield chapter
+        raise ValueError("Each line must be a JSON object")
+
+    progress = await dal.store_novel_stream(header(novel_id), chapters(), str(AUTHOR))
+
+    assert progress["received"] == 3
+    assert progress["error"] == "Each line must be a JSON object"
+
+
+async def test_new_upload_numbers_from_one(stored, monkeypatch):
+    novel_id = ObjectId()
+
+    async def create_novel(book, user_id, chapter_count, upload_total=None):
+        assert (chapter_count, upload_total) == (0, 3)
+        return novel_id
+
+    monkeypatch.setattr(dal, "create_novel", create_novel)
+    progress = await dal.store_novel_stream(header(total=3), lines(None, None, None), str(AUTHOR))
+
+    assert flat(stored) == [(1, "line 1"), (2, "line 2"), (3, "line 3")]
+    assert progress == {"novel_id": str(novel_id), "received": 3, "total": 3, "complete": True}
+
+
+async def test_finished_or_foreign_uploads_cannot_be_resumed(mongo, stored):
+    novel_id = await unfinished_upload(mongo, received=0, total=6)
+    with pytest.raises(ValueError):
+        await dal.store_novel_stream(header(novel_id), lines(1), str(ObjectId()))
+
+    await mongo["novels"].update_one({"_id": novel_id}, {"$set": {"upload_complete": True}})
+    with pytest.raises(ValueError):
+        await dal.store_novel_stream(header(novel_id), lines(1), str(AUTHOR))
@@ -0,0 +1,51 @@
+from datetime import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+import dal
+
+
+@pytest.fixture
+async def author(mongo):
+    user = {"_id": ObjectId(), "username": "ann", "name": "Ann", "is_active": True,
+            "is_admin": False, "is_author": False, "hashed_password": "x"}
+    await mongo["users"].insert_one(user)
+    return user
+
+
+async def test_principal_is_cached_without_password(author, mongo):
+    principal = await dal.get_principal("ann")
+    assert "hashed_password" not in principal
+
+    await mongo["users"].update_one({"_id": author["_id"]}, {"$set": {"name": "changed"}})
+    assert (await dal.get_principal("ann"))["name"] == "Ann"
+
+
+async def test_toggle_user_active_invalidates_principal(author):
+    assert await dal.get_principal("ann")
+
+    await dal.toggle_user_active(str(author["_id"]))
+    assert await dal.get_principal("ann") is None
+
+
+async def test_update_user_name_invalidates_principal(author):
+    await dal.get_principal("ann")
+
+    await dal.update_user_name(str(author["_id"]), "Ann Lee")
+    assert (await dal.get_principal("ann"))["name"] == "Ann Lee"
+
+
+async def test_active_book_invalidates_principal(author, mongo, monkeypatch):
+    async def index_book_search(book_ids):
+        return len(book_ids)
+
+    # mongomock's bulk_write rejects the UpdateOne ops of current pymongo
+    monkeypatch.setattr(dal, "index_book_search", index_book_search)
+    novel = await mongo["novels"].insert_one({
+        "title": "Đường về", "description": "", "author": author["_id"], "genres": [],
+        "is_valid": False, "is_approved": False, "updated_at": datetime.now()})
+    assert (await dal.get_principal("ann"))["is_author"] is False
+
+    await dal.active_book(str(novel.inserted_id))
+    assert (await dal.get_principal("ann"))["is_author"] is True
@@ -0,0 +1,86 @@
+from suggest import SuggestIndex
+
+
+def results(index, q):
+    return [(r["type"], r["id"]) for r in index.search(q)]
+
+
+def test_author_is_listed_while_they_have_a_book():
+    index = SuggestIndex()
+    index.add_book("b1", "Đường về nhà", "a1", "Ann Lee")
+    index.add_book("b2", "Mùa hè", "a1", "Ann Lee")
+    assert results(index, "ann") == [("author", "a1")]
+
+    index.remove_book("b1")
+    assert results(index, "ann") == [("author", "a1")]
+    assert results(index, "duong") == []
+
+    index.remove_book("b2")
+    assert results(index, "ann") == []
+    assert index._keys == []
+
+
+def test_readding_a_book_replaces_its_title():
+    index = SuggestIndex()
+    index.add_book("b1", "Old title", "a1", "Ann")
+    index.add_book("b1", "New title", "a1", "Ann")
+
+    assert results(index, "old") == []
+    assert results(index, "new") == [("book", "b1")]
+
+
+def test_rename_author_drops_the_old_keys():
+    index = SuggestIndex()
+    index.add_book("b1", "Mùa hè", "a1", "Ann Lee")
+    index.rename_author("a1", "Bích Ngọc")
+
+    assert results(index, "ann") == []
+    assert results(index, "lee") == []
+    assert index.search("ngoc") == [{"type": "author", "id": "a1", "name": "Bích Ngọc"}]
+
+    # renaming someone without indexed books is a no-op
+    index.rename_author("a2", "Nobody")
+    assert results(index, "nobody") == []
+
+
+def test_replace_matches_incremental_adds():
+    books = [
+        ("b1", "Đường về nhà", "a1", "Ann Lee"),
+        ("b2", "Mùa hè năm ấy", "a1", "Ann Lee"),
+        ("b3", "Nhà bên sông", "a2", "Bích Ngọc"),
+    ]
+    incremental = SuggestIndex()
+    for book in books:
+        incremental.add_book(*book)
+
+    replaced = SuggestIndex()
+    replaced.add_book("stale", "Stale", "a9", "Gone")
+    replaced.replace(books)
+
+    assert replaced._keys == incremental._keys
+    assert replaced._books == incremental._books
+    assert replaced._authors == incremental._authors
+
+
+def test_search_matches_word_prefixes_without_diacritics():
+    index = SuggestIndex()
+    index.add_book("b1", "Đường về nhà", "a1", "Ann")
+    index.add_book("b2", "Nhà bên sông", "a1", "Ann")
+
+    assert results(index, "Đường") == [("book", "b1")]
+    assert results(index, "duong ve") == [("book", "b1")]
+    assert results(index, "VE NH") == [("book", "b1")]
+    assert sorted(results(index, "nha")) == [("book", "b1"), ("book", "b2")]
+    assert results(index, "song x") == []
+    assert results(index, "  ") == []
+
+
+def test_search_lists_each_match_once_up_to_the_limit():
+    index = SuggestIndex()
+    index.add_book("b1", "nha nha nha", "a1", "Ann")
+    for i in range(20):
+        index.add_book(f"n{i}", f"Nhà {i}", "a1", "Ann")
+
+    assert results(index, "nha nha") == [("book", "b1")]
+    assert len(index.search("nha", limit=5)) == 5
+    assert len(set(results(index, "nha"))) == 10
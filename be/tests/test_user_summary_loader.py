@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+from bson.objectid import ObjectId
+
+import dal
+
+ANN, BOB = ObjectId(), ObjectId()
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    queries = []
+
+    async def get_user_summaries(user_ids):
+        user_ids = list(user_ids)
+        queries.append(sorted(user_ids))
+        names = {str(ANN): "Ann", str(BOB): "Bob"}
+        return {_id: {"_id": ObjectId(_id), "name": names[_id], "avt": ""}
+                for _id in user_ids if _id in names}
+
+    monkeypatch.setattr(dal, "get_user_summaries", get_user_summaries)
+    return queries
+
+
+async def test_loads_in_one_tick_share_one_query(queries):
+    loader = dal.UserSummaryLoader()
+    ann, bob, again = await asyncio.gather(
+        loader.load(ANN), loader.load(str(BOB)), loader.load(str(ANN)))
+
+    assert (ann["name"], bob["name"], again["name"]) == ("Ann", "Bob", "Ann")
+    assert queries == [sorted([str(ANN), str(BOB)])]
+
+
+async def test_resolved_ids_are_not_queried_again(queries):
+    loader = dal.UserSummaryLoader()
+    await loader.load(ANN)
+    assert (await loader.load_many([ANN, BOB]))[1]["name"] == "Bob"
+
+    assert queries == [[str(ANN)], [str(BOB)]]
+
+
+async def test_unknown_ids_resolve_to_none(queries):
+    loader = dal.UserSummaryLoader()
+    assert await loader.load(ObjectId()) is None
+
+
+async def test_query_errors_reach_every_caller(monkeypatch):
+    async def get_user_summaries(user_ids):
+        raise RuntimeError("mongo down")
+
+    monkeypatch.setattr(dal, "get_user_summaries", get_user_summaries)
+    loader = dal.UserSummaryLoader()
+    results = await asyncio.gather(loader.load(ANN), loader.load(BOB), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+async def test_format_comments_resolves_authors_with_one_query(queries):
+    comments = [{"user_id": ANN}, {"user_id": BOB}, {"user_id": ANN}, {"user_id": ObjectId()}]
+    await dal.format_comments(comments)
+
+    assert [comment["user"] for comment in comments] == ["Ann", "Bob", "Ann", "Unknown"]
+    assert len(queries) == 1
@@ -0,0 +1,87 @@
+import pytest
+
+import util
+
+
+def test_accepts_encoding_plain_list():
+    assert util.accepts_encoding("gzip, deflate, br", "gzip")
+    assert not util.accepts_encoding("deflate, br", "gzip")
+
+
+def test_accepts_encoding_honours_q_values():
+    assert not util.accepts_encoding("gzip;q=0", "gzip")
+    assert not util.accepts_encoding("br, GZIP ; Q=0.0", "gzip")
+    assert util.accepts_encoding("gzip;q=0.5", "gzip")
+
+
+def test_accepts_encoding_wildcard():
+    assert util.accepts_encoding("*", "gzip")
+    assert not util.accepts_encoding("*;q=0", "gzip")
+    assert util.accepts_encoding("*;q=0, gzip", "gzip")
+    assert not util.accepts_encoding("gzip;q=0, *", "gzip")
+
+
+def test_accepts_encoding_missing_header():
+    assert not util.accepts_encoding(None, "gzip")
+    assert not util.accepts_encoding("", "gzip")
+
+
+def test_compress_text_round_trip():
+    text = "Đường về nhà\n" * 100
+    assert util.decompress_text(util.compress_text(text)) == text
+
+
+def test_parse_range():
+    assert util.parse_range("bytes=0-99", 1000) == (0, 99)
+    assert util.parse_range("bytes=900-", 1000) == (900, 999)
+    assert util.parse_range("bytes=-100", 1000) == (900, 999)
+    assert util.parse_range("bytes=900-5000", 1000) == (900, 999)
+
+
+def test_parse_range_ignores_invalid_ranges():
+    assert util.parse_range(None, 1000) is None
+    assert util.parse_range("bytes=0-1,5-6", 1000) is None
+    assert util.parse_range("bytes=a-b", 1000) is None
+    # last-pos below first-pos is invalid, not unsatisfiable
+    assert util.parse_range("bytes=5-3", 1000) is None
+
+
+def test_parse_range_unsatisfiable():
+    with pytest.raises(ValueError):
+        util.parse_range("bytes=1000-", 1000)
+    with pytest.raises(ValueError):
+        util.parse_range("bytes=-0", 1000)
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+async def collect(lines):
+    return [line async for line in lines]
+
+
+async def test_iter_ndjson_joins_lines_split_across_chunks():
+    data = '{"a": 1}\n{"b": "Đường về"}\n\n{"c": 3}'.encode("utf-8")
+    # 5-byte chunks also cut multi-byte characters in half
+    stream = chunks(*(data[i:i + 5] for i in range(0, len(data), 5)))
+
+    assert await collect(util.iter_ndjson(stream, 1024)) == [{"a": 1}, {"b": "Đường về"}, {"c": 3}]
+
+
+async def test_iter_ndjson_rejects_oversized_lines():
+    lines = util.iter_ndjson(chunks(b'{"a": 1}\n', b'{"b": "' + b"x" * 64, b'"}\n'), 32)
+
+    assert await anext(lines) == {"a": 1}
+    with pytest.raises(ValueError):
+        await anext(lines)
+
+
+async def test_iter_ndjson_rejects_lines_that_are_not_objects():
+    with pytest.raises(ValueError):
+        await collect(util.iter_ndjson(chunks(b'{"a": 1}\n[1, 2]\n'), 1024))
+    with pytest.raises(ValueError):
+        await collect(util.iter_ndjson(chunks(b'"text"'), 1024))
+    with pytest.raises(ValueError):
+        await collect(util.iter_ndjson(chunks(b'{"a": \n'), 1024))
@@ -0,0 +1,91 @@
+# view counts and reading progress, buffered in memory and written behind
+
+import os
+import math
+import asyncio
+import logging
+
+from datetime import datetime
+from collections import Counter
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+import dal
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = int(os.getenv("VIEW_FLUSH_SECONDS", "5"))
+
+# trending decays with a half-life of TRENDING_HALF_LIFE_HOURS
+TRENDING_HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", "24"))
+TRENDING_RATE = math.log(2) / (TRENDING_HALF_LIFE_HOURS * 3600)
+TRENDING_EPOCH = datetime(2024, 1, 1)
+
+progress_collection = dal.db["reading_progress"]
+
+_views = Counter()
+_progress = {}
+
+
+def record_view(book_id, chapter_num, user_id=None):
+    # called on the read path: memory only, no database work
+    _views[str(book_id)] += 1
+    if user_id:
+        _progress[(str(user_id), str(book_id))] = (chapter_num, datetime.now())
+
+
+def trending_update(views, now):
+    # The decayed score sum(v * exp(-rate * age)) is kept as its log taken at
+    # TRENDING_EPOCH, log(sum(v * exp(rate * (t - epoch)))). Adding views is
+    # then a log-add-exp, and scores updated at different times stay
+    # comparable, so novels can be sorted by the stored field.
+    added = math.log(views) + TRENDING_RATE * (now - TRENDING_EPOCH).total_seconds()
+    old = {"$ifNull": ["$trending", dal.TRENDING_FLOOR]}
+    high = {"$max": [old, added]}
+    low = {"$min": [old, added]}
+    return {"$add": [high, {"$ln": {"$add": [1, {"$exp": {"$subtract": [low, high]}}]}}]}
+
+
+async def flush():
+    global _views, _progress
+    views, _views = _views, Counter()
+    progress, _progress = _progress, {}
+
+    now = datetime.now()
+    try:
+        if views:
+            await dal.book_collection.bulk_write([
+                UpdateOne({"_id": ObjectId(book_id)}, [{"$set": {
+                    "views": {"$add": [{"$ifNull": ["$views", 0]}, count]},
+                    "trending": trending_update(count, now)
+                }}])
+                for book_id, count in views.items()
+            ], ordered=False)
+            views = None
+
+        if progress:
+            await progress_collection.bulk_write([
+                UpdateOne(
+                    {"user_id": ObjectId(user_id), "novel_id": ObjectId(book_id)},
+                    {"$set": {"chapter_number": chapter_num, "updated_at": read_at}},
+                    upsert=True
+                )
+                for (user_id, book_id), (chapter_num, read_at) in progress.items()
+            ], ordered=False)
+    except Exception as e:
+        # keep whatever was not written for the next flush
+        logger.error("Failed to flush views: %s", e)
+        if views:
+            _views.update(views)
+        for key, value in progress.items():
+            _progress.setdefault(key, value)
+
+
+async def run_flusher():
+    try:
+        while True:
+            await asyncio.sleep(FLUSH_SECONDS)
+            await flush()
+    finally:
+        await flush()
@@ -1,12 +1,33 @@
 import re
+import gzip
+import json
+import base64
+import unicodedata
+
+from datetime import datetime
+
+
+def normalize_text(text):
+    """
+    Lowercases text and strips diacritics, so "Đường Việt" becomes "duong viet".
+    """
+    text = unicodedata.normalize("NFD", text.lower()).replace("đ", "d")
+    return "".join(c for c in text if unicodedata.category(c) != "Mn")
+
+
+def search_terms(text):
+    """
+    Normalizes text into space-separated words for searching.
+    """
+    return re.sub(r'[^a-z0-9]+', ' ', normalize_text(text)).strip()
 
 
 def generate_slug(text):
     """
     Converts a given text into a URL-friendly slug.
     """
-    # Convert to lowercase
-    slug = text.lower()
+    # Convert to lowercase and drop diacritics
+    slug = normalize_text(text)
     # Remove special characters and punctuation
     slug = re.sub(r'[^a-z0-9\s-]', '', slug)
     # Replace spaces (and similar) with hyphens
@@ -16,3 +37,130 @@ def generate_slug(text):
     # Trim hyphens from start and end
     slug = slug.strip('-')
     return slug
+
+
+async def iter_ndjson(chunks, max_line_bytes):
+    """
+    Parses a stream of byte chunks as newline-delimited JSON, one object per
+    line, holding at most one line in memory. Raises ValueError on a line
+    that is not a JSON object.
+    """
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer += chunk
+        start = 0
+        while (end := buffer.find(b"\n", start)) != -1:
+            line = bytes(buffer[start:end]).strip()
+            start = end + 1
+            if line:
+                yield parse_ndjson_line(line)
+        del buffer[:start]
+
+        if len(buffer) > max_line_bytes:
+            raise ValueError(f"Line longer than {max_line_bytes} bytes")
+
+    line = bytes(buffer).strip()
+    if line:
+        yield parse_ndjson_line(line)
+
+
+def parse_ndjson_line(line):
+    value = json.loads(line)
+    if not isinstance(value, dict):
+        raise ValueError("Each line must be a JSON object")
+    return value
+
+
+def parse_range(header, length):
+    """
+    Parses a single "bytes=start-end" Range header into an inclusive
+    (start, end). Returns None when there is no usable range, and raises
+    ValueError when the range lies outside the content.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else length - 1
+            if last and end < start:
+                # a last-pos before first-pos makes the range invalid,
+                # which is ignored like a malformed one
+                return None
+            end = min(end, length - 1)
+        else:
+            # suffix range: the final `last` bytes
+            start = max(length - int(last), 0)
+            end = length - 1
+    except ValueError:
+        # malformed ranges are ignored and the whole content is sent
+        return None
+
+    if start < 0 or start >= length or start > end:
+        raise ValueError(f"Range not satisfiable: {header}")
+    return start, end
+
+
+def compress_text(text):
+    """
+    Gzips text as UTF-8; the result can be sent as-is with Content-Encoding: gzip.
+    """
+    return gzip.compress(text.encode("utf-8"), compresslevel=6, mtime=0)
+
+
+def decompress_text(data):
+    """
+    Reverses compress_text.
+    """
+    return gzip.decompress(data).decode("utf-8")
+
+
+def accepts_encoding(header, coding):
+    """
+    Checks whether an Accept-Encoding header allows `coding`, honouring
+    q-values and "*", so "gzip;q=0" refuses gzip.
+    """
+    quality = {}
+    for part in (header or "").split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        quality[name] = q
+
+    return quality.get(coding, quality.get("*", 0)) > 0
+
+
+def encode_cursor(value, _id):
+    """
+    Packs the sort key and id of the last item of a page into an opaque cursor.
+    """
+    if isinstance(value, datetime):
+        value = {"$date": value.isoformat()}
+    data = json.dumps({"v": value, "id": str(_id)})
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Reverses encode_cursor, raising ValueError on anything malformed.
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        value = data["v"]
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value["$date"])
+        return value, data["id"]
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
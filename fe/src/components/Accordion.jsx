@@ -1,10 +1,17 @@
 /* eslint-disable react/prop-types */
 
 import { useState } from 'react'
-const Accordion = ({ title, content }) => {
+const Accordion = ({ title, content, loadContent }) => {
     const [isOpen, setIsOpen] = useState(false)
+    const [loaded, setLoaded] = useState(content)
 
-    const toggleAccordion = () => setIsOpen(!isOpen)
+    const toggleAccordion = async () => {
+        setIsOpen(!isOpen)
+        // Fetch the body the first time the panel is opened
+        if (!isOpen && loaded === undefined && loadContent) {
+            setLoaded(await loadContent())
+        }
+    }
 
     return (
         <div className="w-full max-w-lg mx-auto mb-4">
@@ -14,7 +21,7 @@ const Accordion = ({ title, content }) => {
 
             {isOpen && (
                 <div className="bg-gray-100 p-4 border-t-2 border-gray-300 rounded-b-lg">
-                    <p>{content}</p>
+                    <p>{loaded}</p>
                 </div>
             )}
         </div>
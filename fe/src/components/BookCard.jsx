@@ -6,7 +6,7 @@ const BookCard = ({ book }) => {
         <Link to={`/books/${book._id}`}>
             <div className="max-w-xs overflow-hidden shadow-lg cursor-pointer relative">
                 <img
-                    src={`${import.meta.env.VITE_API_URL}/image/${book.cover}`}
+                    src={`${import.meta.env.VITE_API_URL}/image/${book.cover}?w=400`}
                     alt={book.title}
                     className="w-full h-64 object-cover"
                 />
@@ -32,6 +32,16 @@ const ChapterForm = () => {
         }
     }
 
+    // The book details only carry the table of contents
+    // body-only endpoint: previewing must not count as a read
+    const fetchChapterContent = async (chapterNumber) => {
+        const response = await axiosInstance.get(
+            `${import.meta.env.VITE_API_URL}/books/${bookId}/chapters/${chapterNumber}/content`,
+            { responseType: 'text' }
+        )
+        return response.data
+    }
+
     useEffect(() => {
         window.scrollTo(0, 0)
         fetchBook() // Call fetchBook when the component mounts or bookId changes
@@ -59,9 +69,7 @@ const ChapterForm = () => {
             return
         }
 
-        const invalidChapter = book.chapters.find((chapter) => chapter.content.length < 100)
-        if (invalidChapter) {
-            setLoading(false)
+        if (chapter.content.length < 100) {
             setError('Each chapter must have content with at least 100 characters.')
             return
         }
@@ -108,9 +116,9 @@ const ChapterForm = () => {
                             {/* All chapters */}
                             {book.chapters.map((chapter) => (
                                 <Accordion
-                                    key={chapter._id}
+                                    key={chapter.chapter_number}
                                     title={chapter.title}
-                                    content={chapter.content}
+                                    loadContent={() => fetchChapterContent(chapter.chapter_number)}
                                 />
                             ))}
                             <h2 className="text-xl font-semibold mb-4">